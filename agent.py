@@ -1,56 +1,121 @@
 import os
 import requests
+from requests.adapters import HTTPAdapter
+import urllib3
+from urllib3.util.retry import Retry
 import base64
+import html
 import json
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from datetime import datetime, timedelta
+import logging
+import quopri
+import re
+import string
+import sys
+import threading
+import uuid
+from email.header import Header
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from functools import lru_cache
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+from flask import current_app
 import google.generativeai as genai
-from requests_oauthlib import OAuth2Session
-import pytz
+import orjson
 from database import (
-    get_all_users, get_user_tokens, is_token_expired, User,
-    log_email_sent  
+    db, get_users_with_tokens, User,
+    log_email_sent, log_email_sent_bulk
 )
-from utils import refresh_access_token, get_valid_token, GOOGLE_CLIENT_ID
+from utils import get_valid_token, get_valid_tokens_bulk
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+_BAR = "=" * 60
+
 EMAIL_USER = os.getenv("EMAIL_USER")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-model = None
+GEMINI_MODEL_NAME = 'gemini-pro'
+# Summaries already run in parallel on the user pool; cap how many hit
+# Gemini at once so a large run stays inside the RPM quota
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+_gemini_slots = threading.BoundedSemaphore(GEMINI_MAX_CONCURRENCY)
+# With this many events or fewer the template reads just as well, so skip Gemini
+AI_MIN_EVENTS = int(os.getenv("AI_MIN_EVENTS", "2"))
+# Set to 1 to not send the "no events" email to users with an empty calendar
+SKIP_EMPTY_CALENDARS = os.getenv("SKIP_EMPTY_CALENDARS", "0") == "1"
+
 
-if GEMINI_API_KEY:
+@lru_cache(maxsize=1)
+def get_model():
+    """Configure Gemini on first use; None means use the fallback template"""
+    if not GEMINI_API_KEY:
+        logger.warning("[!] No GEMINI_API_KEY found in .env")
+        return None
+    
     try:
         genai.configure(api_key=GEMINI_API_KEY)
-        model_names = ['gemini-pro'] 
-        for model_name in model_names:
-            try:
-                model = genai.GenerativeModel(model_name)
-                test_response = model.generate_content("Hello")
-                if test_response:
-                    print(f"[+] Using Gemini model: {model_name}")
-                    break
-            except Exception as e:
-                print(f"[!] {model_name} not available: {str(e)}")
-                continue
-        if not model:
-            print("[!] No Gemini models available, will use fallback")
-            
+        model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+        logger.info("[+] Using Gemini model: %s", GEMINI_MODEL_NAME)
+        return model
     except Exception as e:
-        print(f"[!] Gemini setup failed: {str(e)}")
-        model = None
-else:
-    print("[!] No GEMINI_API_KEY found in .env")
+        logger.warning("[!] Gemini setup failed: %s", e)
+        return None
 
 USER_TIMEZONE = os.getenv("USER_TIMEZONE", "UTC")
+UTC = timezone.utc
+
+try:
+    USER_TZ = ZoneInfo(USER_TIMEZONE)
+except (ZoneInfoNotFoundError, ValueError):
+    logger.warning("[!] Unknown USER_TIMEZONE '%s', using UTC", USER_TIMEZONE)
+    USER_TZ = UTC
+MAX_CONCURRENT_USERS = int(os.getenv("MAX_CONCURRENT_USERS", "16"))
+
+CALENDAR_EVENTS_URL = 'https://www.googleapis.com/calendar/v3/calendars/primary/events'
+CALENDAR_BATCH_URL = 'https://www.googleapis.com/batch/calendar/v3'
+CALENDAR_BATCH_LIMIT = 50
+# Batch parts with these statuses are retried as single requests
+CALENDAR_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Shared connection pool so Google API calls reuse warm TCP/TLS connections.
+# Throttling and 5xx on GETs are retried in urllib3 with jittered backoff,
+# honouring Retry-After; POSTs (Gmail send, batch) are never retried here.
+# After the last try the response is returned for the caller's status check.
+_RETRY_JITTER = {'backoff_jitter': 0.3} if int(urllib3.__version__.split('.')[0]) >= 2 else {}
+_HTTP_RETRY = Retry(
+    total=3, backoff_factor=0.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=frozenset(['GET']),
+    respect_retry_after_header=True,
+    raise_on_status=False,
+    **_RETRY_JITTER
+)
+# One kept-alive connection per worker thread and host (Calendar, Gmail), so
+# every send reuses an open TLS connection and none are dropped from a full pool
+_HTTP_ADAPTER = HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=MAX_CONCURRENT_USERS,
+    max_retries=_HTTP_RETRY
+)
+_SESSION = requests.Session()
+_SESSION.mount('https://', _HTTP_ADAPTER)
+
+# Python 3.11+ parses a trailing 'Z' natively
+FROMISOFORMAT_ACCEPTS_Z = sys.version_info >= (3, 11)
+
+@lru_cache(maxsize=4096)
+def _parse_event_time(time_str):
+    """Parse a Calendar dateTime/date string once; the formatters below share it"""
+    if not FROMISOFORMAT_ACCEPTS_Z and time_str.endswith('Z'):
+        time_str = time_str[:-1] + '+00:00'
+    return datetime.fromisoformat(time_str)
 
 def format_time_12hr(time_str):
     try:
         if 'T' in time_str:
-            dt = datetime.fromisoformat(time_str.replace('Z', '+00:00'))
-            return dt.strftime('%I:%M %p').lstrip('0')
+            return _parse_event_time(time_str).strftime('%I:%M %p').lstrip('0')
         else:
             return "All Day"
     except:
@@ -58,129 +123,213 @@ def format_time_12hr(time_str):
 
 def format_date_friendly(time_str):
     try:
-        if 'T' in time_str:
-            dt = datetime.fromisoformat(time_str.replace('Z', '+00:00'))
-        else:
-            dt = datetime.fromisoformat(time_str)
-        return dt.strftime('%A, %B %d, %Y')
+        return _parse_event_time(time_str).strftime('%A, %B %d, %Y')
     except:
         return time_str
 
 
 def format_datetime_full(time_str):
     try:
+        dt = _parse_event_time(time_str)
         if 'T' in time_str:
-            dt = datetime.fromisoformat(time_str.replace('Z', '+00:00'))
             return dt.strftime('%A, %b %d at %I:%M %p').replace(' 0', ' ')
         else:
-            dt = datetime.fromisoformat(time_str)
             return dt.strftime('%A, %b %d (All Day)')
     except:
         return time_str
 
-def fetch_user_calendar_events(user_id, user_email, fetch_days_ahead=7):
+def calendar_time_range(fetch_days_ahead=7):
+    """Start of today in USER_TIMEZONE up to fetch_days_ahead days later, as UTC strings"""
+    # zoneinfo re-resolves the UTC offset after replace()/+timedelta, so a
+    # range crossing a DST change still starts and ends at local midnight
+    start_of_day = datetime.now(USER_TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+    end_time = start_of_day + timedelta(days=fetch_days_ahead)
+    
+    time_min = start_of_day.astimezone(UTC).isoformat(timespec='seconds').replace('+00:00', 'Z')
+    time_max = end_time.astimezone(UTC).isoformat(timespec='seconds').replace('+00:00', 'Z')
+    return time_min, time_max
+
+def calendar_query_params(time_min, time_max):
+    """Events list query shared by the single and batched Calendar requests"""
+    return {
+        'maxResults': 50,
+        'orderBy': 'startTime',
+        'singleEvents': 'true',
+        'timeMin': time_min,
+        'timeMax': time_max,
+        # Partial response: only the fields the summary and email read
+        'fields': 'items(start,summary,description,location)'
+    }
+
+def fetch_user_calendar_events(user_id, user_email, fetch_days_ahead=7, token_data=None):
     """User ke calendar events fetch karo"""
-    print(f"\n{'='*60}")
-    print(f"📅 Fetching calendar for: {user_email}")
-    print(f"{'='*60}")
+    logger.debug("📅 Fetching calendar for: %s", user_email)
     
     try:
-        token_data = get_valid_token(user_id)
+        if token_data is None:
+            token_data = get_valid_token(user_id)
         
         if not token_data:
-            print(f"❌ No valid token for user: {user_email}")
+            logger.error("❌ No valid token for user: %s", user_email)
             return None
         
-        print(f"✅ Valid token obtained")
+        time_min, time_max = calendar_time_range(fetch_days_ahead)
         
-        token = {
-            'access_token': token_data['access_token'],
-            'refresh_token': token_data['refresh_token'],
-            'token_type': 'Bearer'
-        }
-        
-        google = OAuth2Session(GOOGLE_CLIENT_ID, token=token)
-        
-        user_tz = pytz.timezone(USER_TIMEZONE)
-        now_user = datetime.now(user_tz)
-        start_of_day = now_user.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_time = start_of_day + timedelta(days=fetch_days_ahead)
-        
-        time_min = start_of_day.astimezone(pytz.UTC).strftime('%Y-%m-%dT%H:%M:%S') + 'Z'
-        time_max = end_time.astimezone(pytz.UTC).strftime('%Y-%m-%dT%H:%M:%S') + 'Z'
+        logger.debug("📅 Fetching %s to %s (%s)", time_min, time_max, USER_TIMEZONE)
         
-        print(f"🌍 Timezone: {USER_TIMEZONE}")
-        print(f"📅 Fetching from: {start_of_day.strftime('%Y-%m-%d %H:%M')}")
-        print(f"📅 Fetching to: {end_time.strftime('%Y-%m-%d %H:%M')}")
-        
-        response = google.get(
-            'https://www.googleapis.com/calendar/v3/calendars/primary/events?'
-            f'maxResults=50&orderBy=startTime&singleEvents=true&'
-            f'timeMin={time_min}&timeMax={time_max}'
+        # The token was just validated, so skip OAuth2Session and send the header directly
+        response = _SESSION.get(
+            CALENDAR_EVENTS_URL,
+            params=calendar_query_params(time_min, time_max),
+            headers={'Authorization': f"Bearer {token_data['access_token']}"},
+            timeout=30
         )
         
         if response.status_code != 200:
-            print(f"❌ API Error: {response.status_code}")
-            print(f"Response: {response.text}")
+            logger.error("❌ API Error: %s", response.status_code)
+            logger.error("Response: %s", response.text)
             return None
         
-        events = response.json().get('items', [])
-        print(f"✅ Found {len(events)} events")
+        events = orjson.loads(response.content).get('items', [])
+        logger.info("✅ Found %s events for %s", len(events), user_email)
         
         return events
         
     except Exception as e:
-        print(f"❌ Exception while fetching calendar: {str(e)}")
+        logger.error("❌ Exception while fetching calendar: %s", e)
         return None
+
+def _parse_batch_response(response):
+    """Split a multipart/mixed batch response into {content_id: (status_code, body)}"""
+    content_type = response.headers.get('Content-Type', '')
+    boundary = content_type.split('boundary=')[-1].strip('"')
+    parts = {}
     
-def generate_ai_summary(events, user_name, fetch_days_ahead=7):
-    """Gemini AI se summary generate karo"""
-    print(f"\n{'='*60}")
-    print(f"🤖 Generating AI summary")
-    print(f"{'='*60}")
+    for part in response.text.split(f'--{boundary}'):
+        part = part.strip()
+        if not part or part == '--':
+            continue
+        
+        # Part headers, then the embedded HTTP response headers, then the body
+        sections = part.replace('\r\n', '\n').split('\n\n', 2)
+        if len(sections) < 3:
+            continue
+        part_headers, http_headers, body = sections
+        
+        content_id = None
+        for line in part_headers.split('\n'):
+            if line.lower().startswith('content-id:'):
+                content_id = line.split(':', 1)[1].strip().strip('<>')
+                if content_id.startswith('response-'):
+                    content_id = content_id[len('response-'):]
+        
+        status_line = http_headers.split('\n', 1)[0]
+        try:
+            status_code = int(status_line.split()[1])
+        except (IndexError, ValueError):
+            status_code = 0
+        
+        if content_id:
+            parts[content_id] = (status_code, body)
     
-    if not events:
-        print("[!] No events found, creating empty email")
-        return create_professional_email(user_name, [], fetch_days_ahead=fetch_days_ahead, is_empty=True)
+    return parts
+
+
+def fetch_calendar_events_batch(calendar_requests):
+    """
+    Fetch events for many users through Google's batch endpoint.
+    calendar_requests: list of (user_id, access_token, fetch_days_ahead)
+    Returns {user_id: events}; users whose fetch failed are left out.
+    Users in a failed chunk, or whose part hit a transient error, are
+    fetched again one by one.
+    """
+    logger.info("\n%s", _BAR)
+    logger.info("📅 Batch fetching calendars for %s user(s)", len(calendar_requests))
+    logger.info(_BAR)
     
-    if not model:
-        print("[!] Gemini not available, using fallback template")
-        return create_professional_email(user_name, events, fetch_days_ahead=fetch_days_ahead)
+    events_by_user = {}
+    retry_requests = []
     
-    try:
-        events_text = ""
-        for i, event in enumerate(events, 1):
-            start = event['start'].get('dateTime', event['start'].get('date'))
-            formatted_time = format_time_12hr(start)
-            formatted_date = format_date_friendly(start)
-            summary = event.get('summary', 'Untitled Event')
-            description = event.get('description', 'No description')
-            location = event.get('location', 'No location')
-            
-            events_text += f"""
-Event {i}:
-- Title: {summary}
-- Date: {formatted_date}
-- Time: {formatted_time}
-- Location: {location}
-- Description: {description}
-
-"""
+    for chunk_start in range(0, len(calendar_requests), CALENDAR_BATCH_LIMIT):
+        chunk = calendar_requests[chunk_start:chunk_start + CALENDAR_BATCH_LIMIT]
+        boundary = f"batch_{uuid.uuid4().hex}"
+        body_parts = []
+        
+        for user_id, access_token, fetch_days_ahead in chunk:
+            query = urlencode(calendar_query_params(*calendar_time_range(fetch_days_ahead)))
+            body_parts.append(
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <{user_id}>\r\n"
+                "\r\n"
+                f"GET /calendar/v3/calendars/primary/events?{query} HTTP/1.1\r\n"
+                f"Authorization: Bearer {access_token}\r\n"
+                "\r\n"
+            )
+        body = ''.join(body_parts) + f"--{boundary}--\r\n"
+        
+        try:
+            response = _SESSION.post(
+                CALENDAR_BATCH_URL,
+                data=body.encode('utf-8'),
+                headers={'Content-Type': f'multipart/mixed; boundary={boundary}'},
+                timeout=30
+            )
+        except requests.exceptions.RequestException as e:
+            logger.error("❌ Batch request failed: %s", e)
+            retry_requests.extend(chunk)
+            continue
+        
+        if response.status_code != 200:
+            logger.error("❌ Batch API Error: %s", response.status_code)
+            logger.error("Response: %s", response.text[:200])
+            retry_requests.extend(chunk)
+            continue
         
-        prompt = f"""
-You are a professional executive assistant. Create a concise, well-formatted calendar summary email for the next {fetch_days_ahead} days.
+        chunk_by_id = {str(user_id): (user_id, access_token, days) for user_id, access_token, days in chunk}
+        for content_id, (status_code, part_body) in _parse_batch_response(response).items():
+            if status_code != 200:
+                logger.error("❌ Calendar API Error for user_id %s: %s", content_id, status_code)
+                if status_code in CALENDAR_RETRY_STATUSES and content_id in chunk_by_id:
+                    retry_requests.append(chunk_by_id[content_id])
+                continue
+            try:
+                events_by_user[int(content_id)] = orjson.loads(part_body).get('items', [])
+            except (ValueError, TypeError) as e:
+                logger.error("❌ Bad calendar response for user_id %s: %s", content_id, e)
+    
+    for user_id, access_token, fetch_days_ahead in retry_requests:
+        events = fetch_user_calendar_events(
+            user_id, f"user_id {user_id}", fetch_days_ahead,
+            token_data={'access_token': access_token}
+        )
+        if events is not None:
+            events_by_user[user_id] = events
+    
+    logger.info("✅ Fetched calendars for %s/%s user(s)", len(events_by_user), len(calendar_requests))
+    return events_by_user
+    
+# Static pieces of the Gemini prompt; only the gaps change per user
+_PROMPT_HEAD = """
+You are a professional executive assistant. Create a concise, well-formatted calendar summary email for the next """
+_PROMPT_USER = """ days.
 
-User Name: {user_name}
-Number of Events: {len(events)}
-Time Period: Next {fetch_days_ahead} days
+User Name: """
+_PROMPT_COUNT = """
+Number of Events: """
+_PROMPT_PERIOD = """
+Time Period: Next """
+_PROMPT_EVENTS = """ days
 
-Events:
-{events_text}
+Events (JSON):
+"""
+_PROMPT_TASKS = """
 
 Create a professional HTML email that:
 1. Uses a clean, corporate design
 2. Starts with a brief, professional greeting
-3. Mentions the time period ({fetch_days_ahead} days)
+3. Mentions the time period ("""
+_PROMPT_TAIL = """ days)
 4. Provides a quick overview
 5. Lists each event clearly with DATE, TIME (12-hour format), title, and location
 6. Groups events by date if they span multiple days
@@ -195,84 +344,115 @@ IMPORTANT REQUIREMENTS:
 
 Return ONLY the email body HTML (no <html>, <head>, or <body> tags).
 """
+
+
+def _event_fields(event):
+    """(summary, start, location, description) pulled from a Calendar event in one pass"""
+    get = event.get
+    start_get = event['start'].get
+    return (
+        get('summary', 'Untitled Event'),
+        start_get('dateTime') or start_get('date'),
+        get('location', ''),
+        get('description') or ''
+    )
+
+
+def _prompt_event(fields):
+    """One event as a compact dict for the Gemini prompt"""
+    summary, start, location, description = fields
+    return {
+        'title': summary,
+        'date': format_date_friendly(start),
+        'time': format_time_12hr(start),
+        'location': location,
+        'desc': description[:200]
+    }
+    
+def generate_ai_summary(events, user_name, fetch_days_ahead=7, current_date=None):
+    """Gemini AI se summary generate karo"""
+    logger.debug("🤖 Generating AI summary")
+    
+    if not events:
+        logger.info("[!] No events found, creating empty email")
+        return create_professional_email(user_name, [], fetch_days_ahead=fetch_days_ahead, is_empty=True, current_date=current_date)
+    
+    if len(events) <= AI_MIN_EVENTS:
+        logger.info("[*] %s event(s), using template instead of Gemini", len(events))
+        return create_professional_email(user_name, events, fetch_days_ahead=fetch_days_ahead, current_date=current_date)
+    
+    model = get_model()
+    if not model:
+        logger.warning("[!] Gemini not available, using fallback template")
+        return create_professional_email(user_name, events, fetch_days_ahead=fetch_days_ahead, current_date=current_date)
+    
+    try:
+        # Only built once we know Gemini will actually be called
+        prompt_event = _prompt_event
+        event_fields = _event_fields
+        events_text = json.dumps([prompt_event(event_fields(event)) for event in events], ensure_ascii=False)
+        
+        days = str(fetch_days_ahead)
+        prompt = ''.join([
+            _PROMPT_HEAD, days,
+            _PROMPT_USER, user_name,
+            _PROMPT_COUNT, str(len(events)),
+            _PROMPT_PERIOD, days,
+            _PROMPT_EVENTS, events_text,
+            _PROMPT_TASKS, days,
+            _PROMPT_TAIL
+        ])
         
-        print(f"📤 Sending prompt to Gemini...")
+        logger.debug("📤 Sending prompt to Gemini...")
         
-        response = model.generate_content(prompt)
+        with _gemini_slots:
+            response = model.generate_content(prompt)
         
         if not response or not response.text:
-            print(f"⚠️ Empty response from Gemini, using fallback")
-            return create_professional_email(user_name, events, fetch_days_ahead=fetch_days_ahead)
+            logger.warning("⚠️ Empty response from Gemini, using fallback")
+            return create_professional_email(user_name, events, fetch_days_ahead=fetch_days_ahead, current_date=current_date)
         
         summary = response.text
-        final_email = create_professional_email(user_name, events, fetch_days_ahead=fetch_days_ahead, ai_content=summary)
+        final_email = create_professional_email(user_name, events, fetch_days_ahead=fetch_days_ahead, ai_content=summary, current_date=current_date)
         
-        print(f"✅ AI summary generated successfully")
+        logger.info("✅ AI summary generated successfully")
         
         return final_email
         
     except Exception as e:
-        print(f"❌ Gemini API error: {str(e)}")
-        print(f"⚠️ Using fallback summary")
-        return create_professional_email(user_name, events, fetch_days_ahead=fetch_days_ahead)
+        logger.error("❌ Gemini API error: %s", e)
+        logger.warning("⚠️ Using fallback summary")
+        return create_professional_email(user_name, events, fetch_days_ahead=fetch_days_ahead, current_date=current_date)
 
 
-def create_professional_email(user_name, events, fetch_days_ahead=7, ai_content=None, is_empty=False):
-    """Professional email template"""
-    current_date = datetime.now(pytz.UTC).strftime('%A, %B %d, %Y')
-    
-    if fetch_days_ahead == 1:
-        period_text = "Today"
-    elif fetch_days_ahead == 7:
-        period_text = "This Week"
-    else:
-        period_text = f"Next {fetch_days_ahead} Days"
-    
-    if is_empty:
-        content = f"""
-        <div style="text-align: center; padding: 40px 20px;">
-            <div style="font-size: 48px; margin-bottom: 20px;">🔭</div>
-            <h2 style="color: #1f2937; margin-bottom: 10px;">No Events Scheduled</h2>
-            <p style="color: #6b7280; font-size: 16px;">You have no events in the next {fetch_days_ahead} days. Enjoy your time!</p>
-        </div>
-        """
-    elif ai_content:
-        content = ai_content
-    else:
-        content = f"""
-        <h2 style="color: #1f2937; margin-bottom: 10px;">Good Morning, {user_name}!</h2>
-        <p style="color: #4b5563; font-size: 16px; margin-bottom: 30px;">
-            You have <strong>{len(events)} event(s)</strong> scheduled for the next {fetch_days_ahead} days.
-        </p>
-        
-        <div style="background: #f9fafb; padding: 20px; border-radius: 8px; border-left: 4px solid #3b82f6;">
-        """
-        
-        for i, event in enumerate(events, 1):
-            start = event['start'].get('dateTime', event['start'].get('date'))
-            formatted_full_datetime = format_datetime_full(start)
-            summary = event.get('summary', 'Untitled Event')
-            location = event.get('location', '')
-            
-            content += f"""
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def _minify(markup):
+    """Collapse indentation and newlines; the email HTML has no <pre> blocks"""
+    return _WHITESPACE_RE.sub(' ', markup).strip()
+
+
+_EVENT_TPL = string.Template(_minify("""
             <div style="margin-bottom: 20px; padding-bottom: 20px; border-bottom: 1px solid #e5e7eb;">
                 <div style="margin-bottom: 8px;">
                     <span style="background: #3b82f6; color: white; padding: 6px 14px; border-radius: 6px; font-size: 13px; font-weight: 600; display: inline-block; margin-bottom: 8px;">
-                        📅 {formatted_full_datetime}
+                        📅 $datetime
                     </span>
                 </div>
                 <div style="margin-left: 4px;">
                     <span style="color: #1f2937; font-size: 16px; font-weight: 600;">
-                        {summary}
+                        $summary
                     </span>
-                    {f'<div style="color: #6b7280; font-size: 14px; margin-top: 5px;">📍 {location}</div>' if location else ''}
+                    $location_block
                 </div>
             </div>
-            """
-        
-        content += "</div>"
-    
-    email_html = f"""
+            """))
+
+_LOCATION_TPL = string.Template('<div style="color: #6b7280; font-size: 14px; margin-top: 5px;">📍 $location</div>')
+
+
+_HEADER_TPL = string.Template(_minify("""
     <!DOCTYPE html>
     <html>
     <head>
@@ -287,16 +467,18 @@ def create_professional_email(user_name, events, fetch_days_ahead=7, ai_content=
                         <tr>
                             <td style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); padding: 30px; text-align: center;">
                                 <h1 style="color: #ffffff; margin: 0; font-size: 28px; font-weight: 700;">
-                                    📅 {period_text} Calendar Summary
+                                    📅 $period_text Calendar Summary
                                 </h1>
                                 <p style="color: #e0e7ff; margin: 10px 0 0 0; font-size: 14px;">
-                                    {current_date}
+                                    $current_date
                                 </p>
                             </td>
                         </tr>
                         <tr>
                             <td style="padding: 40px 30px;">
-                                {content}
+                                """))
+
+_FOOTER = _minify("""
                             </td>
                         </tr>
                         <tr>
@@ -316,18 +498,100 @@ def create_professional_email(user_name, events, fetch_days_ahead=7, ai_content=
         </table>
     </body>
     </html>
-    """
+    """)
+
+
+def _event_ctx(fields):
+    """Template fields for one fallback event block"""
+    summary, start, location, _ = fields
+    # Titles and locations are user-written calendar text; escape them like
+    # an autoescaping template engine would
+    return {
+        'datetime': format_datetime_full(start),
+        'summary': html.escape(summary),
+        'location_block': _LOCATION_TPL.substitute(location=html.escape(location)) if location else ''
+    }
+
+
+def _period_text(fetch_days_ahead):
+    if fetch_days_ahead == 1:
+        return "Today"
+    elif fetch_days_ahead == 7:
+        return "This Week"
+    return f"Next {fetch_days_ahead} Days"
+
+
+@lru_cache(maxsize=32)
+def _email_header(fetch_days_ahead, current_date):
+    return _HEADER_TPL.substitute(period_text=_period_text(fetch_days_ahead), current_date=current_date)
+
+
+@lru_cache(maxsize=32)
+def _empty_email(fetch_days_ahead, current_date):
+    """The no-events email only varies by period and date, so build it once per pair"""
+    content = _minify(f"""
+        <div style="text-align: center; padding: 40px 20px;">
+            <div style="font-size: 48px; margin-bottom: 20px;">🔭</div>
+            <h2 style="color: #1f2937; margin-bottom: 10px;">No Events Scheduled</h2>
+            <p style="color: #6b7280; font-size: 16px;">You have no events in the next {fetch_days_ahead} days. Enjoy your time!</p>
+        </div>
+        """)
+    return _email_header(fetch_days_ahead, current_date) + content + _FOOTER
+
+
+def create_professional_email(user_name, events, fetch_days_ahead=7, ai_content=None, is_empty=False, current_date=None):
+    """Professional email template"""
+    if current_date is None:
+        current_date = datetime.now(UTC).strftime('%A, %B %d, %Y')
+    
+    if is_empty:
+        return _empty_email(fetch_days_ahead, current_date)
+    
+    if ai_content:
+        content = ai_content
+    else:
+        content = _minify(f"""
+        <h2 style="color: #1f2937; margin-bottom: 10px;">Good Morning, {html.escape(user_name)}!</h2>
+        <p style="color: #4b5563; font-size: 16px; margin-bottom: 30px;">
+            You have <strong>{len(events)} event(s)</strong> scheduled for the next {fetch_days_ahead} days.
+        </p>
+        
+        <div style="background: #f9fafb; padding: 20px; border-radius: 8px; border-left: 4px solid #3b82f6;">
+        """)
+        
+        render_event = _EVENT_TPL.substitute
+        event_fields = _event_fields
+        content = ''.join([content, *[render_event(_event_ctx(event_fields(event))) for event in events], "</div>"])
     
-    return email_html
+    return _email_header(fetch_days_ahead, current_date) + content + _FOOTER
 
-def send_email(to_email, subject, html_content, user_id, user_name, events_count, fetch_days):
-    print(f"🚀 Preparing to send email to {to_email} via Gmail API...")
+def build_raw_message(to_email, subject, html_content):
+    """RFC 822 bytes for a single-part UTF-8 HTML email, without the email package"""
+    if not subject.isascii():
+        subject = Header(subject, 'utf-8').encode()
     
-    # 1. Valid token lo
-    token_data = get_valid_token(user_id)
+    headers = (
+        f"Subject: {subject}\r\n"
+        f"To: {to_email}\r\n"
+        "From: me\r\n"
+        "MIME-Version: 1.0\r\n"
+        'Content-Type: text/html; charset="utf-8"\r\n'
+        "Content-Transfer-Encoding: quoted-printable\r\n"
+        "\r\n"
+    )
+    # The HTML is mostly ASCII, so quoted-printable is far smaller than base64
+    return headers.encode('ascii') + quopri.encodestring(html_content.encode('utf-8'))
+
+def send_email(to_email, subject, html_content, user_id, user_name, events_count, fetch_days, access_token=None, log_batch=None):
+    logger.debug("🚀 Preparing to send email to %s via Gmail API...", to_email)
     
-    if not token_data or not token_data.get('access_token'):
-        print(f"❌ Failed to get valid token for user_id: {user_id}")
+    # 1. Valid token lo (unless the caller already prefetched it)
+    if not access_token:
+        token_data = get_valid_token(user_id)
+        access_token = token_data.get('access_token') if token_data else None
+    
+    if not access_token:
+        logger.error("❌ Failed to get valid token for user_id: %s", user_id)
         log_email_sent(
             user_id=user_id,
             user_name=user_name,
@@ -336,43 +600,33 @@ def send_email(to_email, subject, html_content, user_id, user_name, events_count
             events_count=events_count,
             fetch_days=fetch_days,
             status='failed',
-            error_message="No valid OAuth token"
+            error_message="No valid OAuth token",
+            batch=log_batch
         )
         return False
-        
-    access_token = token_data['access_token']
     
     try:
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = subject
-        msg['To'] = to_email
-        msg['From'] = 'me'  
-        
-        html_part = MIMEText(html_content, 'html', 'utf-8')
-        msg.attach(html_part)
-        
-        raw_message = base64.urlsafe_b64encode(msg.as_bytes()).decode('utf-8')
+        raw_message = base64.urlsafe_b64encode(build_raw_message(to_email, subject, html_content))
         
         headers = {
             'Authorization': f'Bearer {access_token}',
             'Content-Type': 'application/json'
         }
         
-        body = {'raw': raw_message}
+        # The urlsafe base64 alphabet needs no JSON escaping, so build the body bytes directly
+        body = b'{"raw": "' + raw_message + b'"}'
         
-        print(f"📤 Sending request to Gmail API...")
-        
-        response = requests.post(
+        response = _SESSION.post(
             'https://gmail.googleapis.com/gmail/v1/users/me/messages/send',
             headers=headers,
-            json=body,
+            data=body,
             timeout=30
         )
         
-        print(f"📥 Gmail API Response Status: {response.status_code}")
+        logger.debug("📥 Gmail API Response Status: %s", response.status_code)
         
         if response.status_code == 200:
-            print(f"✅ Email sent successfully to {to_email}")
+            logger.info("✅ Email sent successfully to %s", to_email)
             log_email_sent(
                 user_id=user_id,
                 user_name=user_name,
@@ -380,15 +634,16 @@ def send_email(to_email, subject, html_content, user_id, user_name, events_count
                 subject=subject,
                 events_count=events_count,
                 fetch_days=fetch_days,
-                status='success'
+                status='success',
+                batch=log_batch
             )
             return True
             
         elif response.status_code == 403:
             # ❌ SCOPE ERROR - Most common issue
             error_msg = "Insufficient authentication scopes. User needs to re-authenticate with Gmail send permission."
-            print(f"❌ SCOPE ERROR: {error_msg}")
-            print(f"⚠️ SOLUTION: User must logout and login again to grant Gmail.send scope")
+            logger.error("❌ SCOPE ERROR: %s", error_msg)
+            logger.warning("⚠️ SOLUTION: User must logout and login again to grant Gmail.send scope")
             
             log_email_sent(
                 user_id=user_id,
@@ -398,7 +653,8 @@ def send_email(to_email, subject, html_content, user_id, user_name, events_count
                 events_count=events_count,
                 fetch_days=fetch_days,
                 status='failed',
-                error_message=error_msg
+                error_message=error_msg,
+                batch=log_batch
             )
             return False
             
@@ -410,7 +666,7 @@ def send_email(to_email, subject, html_content, user_id, user_name, events_count
             except:
                 error_msg = f"HTTP {response.status_code}: {response.text[:200]}"
             
-            print(f"❌ Gmail API Error: {error_msg}")
+            logger.error("❌ Gmail API Error: %s", error_msg)
             
             log_email_sent(
                 user_id=user_id,
@@ -420,86 +676,201 @@ def send_email(to_email, subject, html_content, user_id, user_name, events_count
                 events_count=events_count,
                 fetch_days=fetch_days,
                 status='failed',
-                error_message=error_msg
+                error_message=error_msg,
+                batch=log_batch
             )
             return False
 
     except requests.exceptions.Timeout:
         error_msg = "Gmail API request timeout (30s)"
-        print(f"❌ {error_msg}")
+        logger.error("❌ %s", error_msg)
         log_email_sent(
             user_id=user_id, user_name=user_name, user_email=to_email,
             subject=subject, events_count=events_count, fetch_days=fetch_days,
-            status='failed', error_message=error_msg
+            status='failed', error_message=error_msg, batch=log_batch
         )
         return False
         
     except requests.exceptions.RequestException as e:
         error_msg = f"Request failed: {str(e)}"
-        print(f"❌ {error_msg}")
+        logger.error("❌ %s", error_msg)
         log_email_sent(
             user_id=user_id, user_name=user_name, user_email=to_email,
             subject=subject, events_count=events_count, fetch_days=fetch_days,
-            status='failed', error_message=error_msg
+            status='failed', error_message=error_msg, batch=log_batch
         )
         return False
         
     except Exception as e:
         error_msg = f"Unexpected error: {str(e)}"
-        print(f"❌ {error_msg}")
+        logger.error("❌ %s", error_msg)
         log_email_sent(
             user_id=user_id, user_name=user_name, user_email=to_email,
             subject=subject, events_count=events_count, fetch_days=fetch_days,
-            status='failed', error_message=error_msg
+            status='failed', error_message=error_msg, batch=log_batch
         )
         return False
 
-def send_email_to_users(user_ids=None, broadcast_from_user_id=None, include_admins=True, fetch_days_ahead=None):
-    print("\n" + "="*60)
+def _process_user(app, user_id, user_email, user_name, user_fetch_days,
+                  events, summary_name, is_broadcast, run_date, current_date, log_batch, access_token=None,
+                  summary_html=None):
+    """Summarize and send for one user. Returns True if the email was sent."""
+    with app.app_context():
+        # One record so banners from parallel workers don't interleave
+        logger.info(
+            "\n%s\n👤 Sending to: %s (%s)\n📅 Using %s days\n%s",
+            _BAR, user_name, user_email, user_fetch_days, _BAR
+        )
+        
+        try:
+            if events is None:
+                logger.error("❌ Failed to fetch events for %s", user_email)
+                
+                log_email_sent(
+                    user_id=user_id,
+                    user_email=user_email,
+                    user_name=user_name,
+                    subject=f"📅 Calendar Summary - {run_date}",
+                    status='failed',
+                    error_message='Failed to fetch calendar events',
+                    events_count=0,
+                    fetch_days=user_fetch_days,
+                    batch=log_batch
+                )
+                return False
+            
+            if SKIP_EMPTY_CALENDARS and not events:
+                logger.info("[*] No events for %s, skipping email", user_email)
+                return True
+            
+            if summary_html is None:
+                summary_html = generate_ai_summary(events, summary_name, user_fetch_days, current_date=current_date)
+            
+            if is_broadcast:
+                subject = f"📅 Team Calendar Update - {run_date}"
+            else:
+                subject = f"📅 Your {user_fetch_days}-Day Calendar Summary - {run_date}"
+            
+            email_sent = send_email(
+                to_email=user_email,
+                subject=subject,
+                html_content=summary_html,
+                user_id=user_id,
+                user_name=user_name,
+                events_count=len(events) if events else 0,
+                fetch_days=user_fetch_days,
+                access_token=access_token,
+                log_batch=log_batch
+            )
+            
+            if email_sent:
+                logger.info("✅ Successfully sent to %s", user_email)
+            else:
+                logger.error("❌ Email failed for %s", user_email)
+            return email_sent
+                
+        except Exception as e:
+            logger.error("❌ Error processing %s: %s", user_email, e)
+            
+            log_email_sent(
+                user_id=user_id,
+                user_email=user_email,
+                user_name=user_name,
+                subject=f"📅 Calendar Summary - {run_date}",
+                status='failed',
+                error_message=str(e),
+                events_count=0,
+                fetch_days=user_fetch_days,
+                batch=log_batch
+            )
+            return False
+
+
+def send_email_to_users(user_ids=None, broadcast_from_user_id=None, include_admins=True, fetch_days_ahead=None,
+                        broadcast_user=None):
+    # Callers that already loaded the broadcaster pass it in to skip the lookup
+    if broadcast_user is not None:
+        broadcast_from_user_id = broadcast_user.id
+    
+    # Dates are fixed for the whole run, failure paths included, instead of
+    # re-read per email
+    run_time = datetime.now(UTC)
+    run_date = run_time.strftime('%B %d, %Y')
+    current_date = run_time.strftime('%A, %B %d, %Y')
+    
+    logger.info("\n%s", _BAR)
     if broadcast_from_user_id:
-        print("📢 BROADCAST MODE")
+        logger.info("📢 BROADCAST MODE")
     else:
         if fetch_days_ahead:
-            print(f"🤖 PERSONALIZED MODE - Fixed {fetch_days_ahead} days")
+            logger.info("🤖 PERSONALIZED MODE - Fixed %s days", fetch_days_ahead)
         else:
-            print("🤖 PERSONALIZED MODE - Individual preferences")
-    print("="*60)
-    print(f"⏰ Time: {datetime.now(pytz.UTC)}")
-    print(f"🌍 Timezone: {USER_TIMEZONE}")
-    print(f"👥 Include Admins: {include_admins}")
-    print("="*60 + "\n")
+            logger.info("🤖 PERSONALIZED MODE - Individual preferences")
+    logger.info(_BAR)
+    logger.info("⏰ Time: %s", run_time)
+    logger.info("🌍 Timezone: %s", USER_TIMEZONE)
+    logger.info("👥 Include Admins: %s", include_admins)
+    logger.info("%s\n", _BAR)
     
+    # Token rows come back with the users so the token lookup needs no extra query
     if user_ids:
-        users = User.query.filter(User.id.in_(user_ids)).all()
-        print(f"👥 Sending to {len(users)} selected user(s)")
+        users = get_users_with_tokens(user_ids)
+        logger.info("👥 Sending to %s selected user(s)", len(users))
     else:
-        users = get_all_users()
-        print(f"👥 Total users in database: {len(users)}")
+        users = get_users_with_tokens()
+        logger.info("👥 Total users in database: %s", len(users))
         
         if not include_admins:
             users = [u for u in users if not u.is_admin()]
-            print(f"👤 Filtered to {len(users)} regular users")
+            logger.info("👤 Filtered to %s regular users", len(users))
     
     if not users:
-        print("⚠️ No users found")
+        logger.warning("⚠️ No users found")
         return {'total': 0, 'success': 0, 'failed': 0}
     
+    token_user_ids = [u.id for u in users]
+    if broadcast_from_user_id:
+        token_user_ids.append(broadcast_from_user_id)
+    token_records = {u.id: u.tokens[0] for u in users if u.tokens}
+    tokens = get_valid_tokens_bulk(token_user_ids, token_records=token_records)
+    
     broadcast_events = None
     broadcast_user_name = None
     broadcast_fetch_days = fetch_days_ahead or 7
     
     if broadcast_from_user_id:
-        broadcast_user = User.query.get(broadcast_from_user_id)
+        if broadcast_user is None:
+            broadcast_user = db.session.get(User, broadcast_from_user_id)
         if broadcast_user:
-            print(f"\n📢 Fetching events from: {broadcast_user.name}")
-            broadcast_events = fetch_user_calendar_events(broadcast_from_user_id, broadcast_user.email, broadcast_fetch_days)
+            logger.info("\n📢 Fetching events from: %s", broadcast_user.name)
+            broadcast_events = fetch_user_calendar_events(
+                broadcast_from_user_id, broadcast_user.email, broadcast_fetch_days,
+                token_data=tokens.get(broadcast_from_user_id)
+            )
             broadcast_user_name = broadcast_user.name
             
             if broadcast_events is None:
-                print(f"❌ Failed to fetch broadcast events")
+                logger.error("❌ Failed to fetch broadcast events")
+                
+                failed_rows = []
+                subject = f"📅 Team Calendar Update - {run_date}"
+                for user in users:
+                    log_email_sent(
+                        user_id=user.id,
+                        user_email=user.email,
+                        user_name=user.name,
+                        subject=subject,
+                        status='failed',
+                        error_message='Broadcast fetch failed',
+                        events_count=0,
+                        fetch_days=broadcast_fetch_days,
+                        batch=failed_rows
+                    )
+                log_email_sent_bulk(failed_rows)
+                
                 return {'total': len(users), 'success': 0, 'failed': len(users)}
             
-            print(f"✅ Will broadcast {len(broadcast_events)} events\n")
+            logger.info("✅ Will broadcast %s events\n", len(broadcast_events))
     
     results = {
         'total': len(users),
@@ -507,92 +878,78 @@ def send_email_to_users(user_ids=None, broadcast_from_user_id=None, include_admi
         'failed': 0
     }
     
+    # Each user's summary + send is independent network I/O (Gemini, Gmail),
+    # so run users concurrently. Workers get plain values, not ORM objects,
+    # and push their own app context so each has its own DB session.
+    app = current_app._get_current_object()
+    # Workers append log rows here; they are written with one commit at the end
+    log_batch = []
+    user_jobs = []
     for user in users:
-        print(f"\n{'='*60}")
-        print(f"👤 Sending to: {user.name} ({user.email})")
-        
         if fetch_days_ahead:
             user_fetch_days = fetch_days_ahead
-            print(f"📅 Using FIXED days: {user_fetch_days}")
         else:
             user_fetch_days = user.fetch_days or 7
-            print(f"📅 Using USER preference: {user_fetch_days} days")
-        
-        print(f"{'='*60}")
-        
-        try:
-            if broadcast_from_user_id and broadcast_events is not None:
-                events = broadcast_events
-                summary_name = f"{broadcast_user_name}'s Schedule"
-                print(f"📢 Using broadcast events")
-            else:
-                events = fetch_user_calendar_events(user.id, user.email, user_fetch_days)
-                summary_name = user.name
-                
-                if events is None:
-                    print(f"❌ Failed to fetch events for {user.email}")
-                    
-                    log_email_sent(
-                        user_id=user.id,
-                        user_email=user.email,
-                        user_name=user.name,
-                        subject=f"📅 Calendar Summary - {datetime.now(pytz.UTC).strftime('%B %d, %Y')}",
-                        status='failed',
-                        error_message='Failed to fetch calendar events',
-                        events_count=0,
-                        fetch_days=user_fetch_days
-                    )
-                    
-                    results['failed'] += 1
-                    continue
-            
-            summary_html = generate_ai_summary(events, summary_name, user_fetch_days)
-            
-            if broadcast_from_user_id:
-                subject = f"📅 Team Calendar Update - {datetime.now(pytz.UTC).strftime('%B %d, %Y')}"
+        user_jobs.append((user.id, user.email, user.name, user_fetch_days))
+    
+    if broadcast_from_user_id and broadcast_events is not None:
+        logger.info("📢 Using broadcast events")
+        events_by_user = {user_id: broadcast_events for user_id, _, _, _ in user_jobs}
+        summary_name = f"{broadcast_user_name}'s Schedule"
+        # Every recipient gets the same email, so call Gemini once per period
+        # (normally just one) instead of once per user
+        summaries_by_days = {
+            days: generate_ai_summary(broadcast_events, summary_name, days, current_date=current_date)
+            for days in {user_fetch_days for _, _, _, user_fetch_days in user_jobs}
+        }
+    else:
+        # One batched Calendar call per 50 users instead of one request each
+        calendar_requests = []
+        for user_id, user_email, user_name, user_fetch_days in user_jobs:
+            token_data = tokens.get(user_id)
+            if token_data and token_data.get('access_token'):
+                calendar_requests.append((user_id, token_data['access_token'], user_fetch_days))
             else:
-                subject = f"📅 Your {user_fetch_days}-Day Calendar Summary - {datetime.now(pytz.UTC).strftime('%B %d, %Y')}"
-            
-            email_sent = send_email(
-                to_email=user.email,
-                subject=subject,
-                html_content=summary_html,
-                user_id=user.id,
-                user_name=user.name,
-                events_count=len(events) if events else 0,
-                fetch_days=user_fetch_days
+                logger.error("❌ No valid token for user: %s", user_email)
+        events_by_user = fetch_calendar_events_batch(calendar_requests)
+        summary_name = None
+        summaries_by_days = {}
+    
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_USERS) as executor:
+        futures = [
+            executor.submit(
+                _process_user, app, user_id, user_email, user_name, user_fetch_days,
+                events_by_user.get(user_id), summary_name or user_name,
+                bool(broadcast_from_user_id),
+                run_date,
+                current_date,
+                log_batch,
+                tokens.get(user_id, {}).get('access_token'),
+                summaries_by_days.get(user_fetch_days)
             )
-            
-            if email_sent:
-                print(f"✅ Successfully sent to {user.email}")
+            for user_id, user_email, user_name, user_fetch_days in user_jobs
+        ]
+        for future in as_completed(futures):
+            try:
+                sent = future.result()
+            except Exception as e:
+                # Keep counting the rest so the log batch still gets written
+                logger.error("❌ Worker error: %s", e)
+                sent = False
+            if sent:
                 results['success'] += 1
             else:
-                print(f"❌ Email failed for {user.email}")
                 results['failed'] += 1
-                
-        except Exception as e:
-            print(f"❌ Error processing {user.email}: {str(e)}")
-            
-            log_email_sent(
-                user_id=user.id,
-                user_email=user.email,
-                user_name=user.name,
-                subject=f"📅 Calendar Summary - {datetime.now(pytz.UTC).strftime('%B %d, %Y')}",
-                status='failed',
-                error_message=str(e),
-                events_count=0,
-                fetch_days=user_fetch_days
-            )
-            
-            results['failed'] += 1
     
-    print("\n" + "="*60)
-    print("📊 EXECUTION SUMMARY")
-    print("="*60)
-    print(f"Total Recipients: {results['total']}")
-    print(f"✅ Success: {results['success']}")
-    print(f"❌ Failed: {results['failed']}")
-    print("="*60 + "\n")
+    log_email_sent_bulk(log_batch)
+    
+    logger.info("\n%s", _BAR)
+    logger.info("📊 EXECUTION SUMMARY")
+    logger.info(_BAR)
+    logger.info("Total Recipients: %s", results['total'])
+    logger.info("✅ Success: %s", results['success'])
+    logger.info("❌ Failed: %s", results['failed'])
+    logger.info("%s\n", _BAR)
     
     return results
 
@@ -603,12 +960,12 @@ def run_daily_summary_agent(broadcast_mode=False, send_to_admins=False, fetch_da
         if admin_user:
             return send_email_to_users(
                 user_ids=None, 
-                broadcast_from_user_id=admin_user.id,
                 include_admins=send_to_admins,
-                fetch_days_ahead=fetch_days_ahead
+                fetch_days_ahead=fetch_days_ahead,
+                broadcast_user=admin_user
             )
         else:
-            print("❌ No admin found for broadcast")
+            logger.error("❌ No admin found for broadcast")
             return {'total': 0, 'success': 0, 'failed': 0}
     else:
         return send_email_to_users(
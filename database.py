@@ -1,9 +1,51 @@
+from collections import namedtuple
 from datetime import datetime, timedelta
+from functools import lru_cache
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
 from encryption import encrypt_token, decrypt_token
+import logging
 import os
-
-db = SQLAlchemy()
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Objects keep their loaded values after commit instead of re-SELECTing on
+# the next attribute read; sessions are per request/job, so they don't go stale
+db = SQLAlchemy(session_options={'expire_on_commit': False})
+
+_log_write_lock = threading.Lock()
+
+# admin_required, /dashboard and /logout only need a few user fields; keep
+# those in memory for a short while instead of loading the User row each time
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "60"))
+_user_cache = {}
+_user_cache_lock = threading.Lock()
+
+# {role: count} for the dashboard header; dropped whenever a user is added or
+# changes role, the TTL only covers writes made by other processes
+USER_ROLE_COUNTS_TTL = 300
+_role_counts_cache = None
+
+
+@event.listens_for(Engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL lets the scheduler thread write while web requests read"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA cache_size=-64000")
+    # Reads go through a 128 MB memory map instead of read() syscalls
+    cursor.execute("PRAGMA mmap_size=134217728")
+    cursor.close()
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -11,7 +53,7 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(255), unique=True, nullable=False)
     name = db.Column(db.String(255))
-    role = db.Column(db.String(50), default='user')  
+    role = db.Column(db.String(50), default='user', index=True)  
     fetch_days = db.Column(db.Integer, default=7)  
     # ❌ TIMEZONE FIELD REMOVED
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -29,7 +71,8 @@ class Token(db.Model):
     __tablename__ = 'tokens'
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    # One token row per user; the unique index makes lookups by user_id O(log n)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, unique=True, index=True)
     
     access_token = db.Column(db.LargeBinary, nullable=False)
     refresh_token = db.Column(db.LargeBinary, nullable=True)
@@ -42,24 +85,61 @@ class Token(db.Model):
         return f'<Token user_id={self.user_id}>'
 
 
+PENDING_JOBS_WHERE = "status = 'pending'"
+
+
 class ScheduledJob(db.Model):
     __tablename__ = 'scheduled_jobs'
+    # Partial index holding only pending jobs, in run order. SQLite only uses
+    # it when the query repeats the same literal WHERE, see get_pending_jobs
+    __table_args__ = (
+        db.Index(
+            'ix_jobs_pending', 'scheduled_time',
+            sqlite_where=db.text(PENDING_JOBS_WHERE),
+            postgresql_where=db.text(PENDING_JOBS_WHERE)
+        ),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     job_id = db.Column(db.String(100), unique=True, nullable=False)  
-    scheduled_time = db.Column(db.DateTime, nullable=False) 
-    status = db.Column(db.String(50), default='pending')  
-    user_ids = db.Column(db.Text)  
+    # Written as an aware UTC datetime; SQLite hands it back naive (still UTC)
+    scheduled_time = db.Column(db.DateTime(timezone=True), nullable=False) 
+    status = db.Column(db.String(50), default='pending', index=True)  
+    user_ids = db.Column(db.JSON, default=list)  # [1, 2, 3]; empty list = all users
+    user_count = db.Column(db.Integer, nullable=False, default=0)  # len(user_ids), 0 = all users
     created_by = db.Column(db.Integer, db.ForeignKey('users.id')) 
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # scanned backwards for ORDER BY DESC
     completed_at = db.Column(db.DateTime)
     
+    creator = db.relationship('User', foreign_keys=[created_by])
+    
     def __repr__(self):
         return f'<ScheduledJob {self.job_id} @ {self.scheduled_time}>'
 
 
+class JobRun(db.Model):
+    """One row per cron run; the unique pair lets only one process claim it"""
+    __tablename__ = 'job_runs'
+    __table_args__ = (
+        db.UniqueConstraint('job_id', 'run_date', name='uq_job_runs_job_date'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(100), nullable=False)
+    run_date = db.Column(db.Date, nullable=False)
+    claimed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<JobRun {self.job_id} {self.run_date}>'
+
+
 class EmailLog(db.Model):
     __tablename__ = 'email_logs'
+    # Date-range filters plus status counts are answered from this index alone;
+    # it leads with sent_at, so sent_at needs no index of its own
+    __table_args__ = (
+        db.Index('ix_email_logs_sent_status', 'sent_at', 'status'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -70,7 +150,7 @@ class EmailLog(db.Model):
     error_message = db.Column(db.Text)
     events_count = db.Column(db.Integer, default=0)
     fetch_days = db.Column(db.Integer, default=7)
-    sent_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    sent_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     user = db.relationship('User', backref='email_logs')
     
@@ -78,37 +158,82 @@ class EmailLog(db.Model):
         return f'<EmailLog {self.user_email} - {self.status} @ {self.sent_at}>'
 
 
+def upgrade_schema():
+    """
+    create_all() never touches existing tables, so bring an older tokens.db
+    in line with the models: fix up old data, add missing columns and indexes
+    """
+    # tokens.user_id became unique; keep only the newest row per user first
+    db.session.execute(db.text(
+        "DELETE FROM tokens WHERE id NOT IN (SELECT MAX(id) FROM tokens GROUP BY user_id)"
+    ))
+    
+    # scheduled_jobs.user_ids used to be a "1,2,3" string; wrap old values
+    # into JSON arrays ('' becomes [] i.e. all users)
+    db.session.execute(db.text(
+        "UPDATE scheduled_jobs SET user_ids = '[' || user_ids || ']' "
+        "WHERE user_ids IS NOT NULL AND user_ids NOT LIKE '[%'"
+    ))
+    
+    # scheduled_jobs.user_count was added later; fill it from user_ids once
+    job_columns = {column['name'] for column in inspect(db.engine).get_columns('scheduled_jobs')}
+    if 'user_count' not in job_columns:
+        db.session.execute(db.text(
+            "ALTER TABLE scheduled_jobs ADD COLUMN user_count INTEGER NOT NULL DEFAULT 0"
+        ))
+        db.session.execute(db.text(
+            "UPDATE scheduled_jobs SET user_count = json_array_length(user_ids) "
+            "WHERE user_ids IS NOT NULL"
+        ))
+    
+    # Single-column sent_at index from older versions; ix_email_logs_sent_status covers it
+    db.session.execute(db.text("DROP INDEX IF EXISTS ix_email_logs_sent_at"))
+    db.session.commit()
+    
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+
+@lru_cache(maxsize=1)
 def get_admin_emails():
+    """ADMIN_EMAILS is fixed for the process, so parse it once into a set"""
     admin_emails_str = os.getenv("ADMIN_EMAILS", "")
     if not admin_emails_str:
-        return []
-    return [email.strip().lower() for email in admin_emails_str.split(',')]
+        return frozenset()
+    return frozenset(email.strip().lower() for email in admin_emails_str.split(','))
 
 
-def get_or_create_user(email, name):
-    user = User.query.filter_by(email=email).first()
-    admin_emails = get_admin_emails()
+def get_or_create_user(email, name, commit=True):
+    # commit=False leaves the commit to the caller, e.g. the OAuth callback
+    # saving the user and token together; that caller must then call
+    # invalidate_user_cache and invalidate_user_role_counts after committing
+    role = 'admin' if email.lower() in get_admin_emails() else 'user'
+    
+    # One atomic upsert instead of SELECT then INSERT/UPDATE, so two first
+    # logins with the same email can't race. An existing user's name is left
+    # alone; only the role follows ADMIN_EMAILS
+    stmt = sqlite_insert(User).values(email=email, name=name, role=role)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.email],
+        set_={'role': stmt.excluded.role}
+    ).returning(User)
+    user = db.session.scalars(stmt, execution_options={'populate_existing': True}).one()
     
-    if not user:
-        role = 'admin' if email.lower() in admin_emails else 'user'
-        user = User(email=email, name=name, role=role)
-        db.session.add(user)
+    if commit:
         db.session.commit()
-        print(f"[+] New {role.upper()} created: {email}")
-    else:
-        expected_role = 'admin' if email.lower() in admin_emails else 'user'
-        if user.role != expected_role:
-            user.role = expected_role
-            db.session.commit()
-            print(f"[~] Role updated to {expected_role.upper()} for: {email}")
-        else:
-            print(f"[+] Existing {user.role.upper()} found: {email}")
+        # Can't tell from the upsert whether the role changed, and logins
+        # are rare. Invalidating before the commit would let another request
+        # cache the old row again
+        invalidate_user_cache(user.id)
+        invalidate_user_role_counts()
+    logger.info("[+] %s signed in: %s", user.role.upper(), email)
     
     return user
 
 
-def save_token(user_id, access_token, refresh_token, expires_in):
-    token_record = Token.query.filter_by(user_id=user_id).first()
+def save_token(user_id, access_token, refresh_token, expires_in, commit=True):
+    token_record = Token.query.filter_by(user_id=user_id).one_or_none()
     expires_at = datetime.utcnow() + timedelta(seconds=expires_in)
     
     if token_record:
@@ -128,15 +253,27 @@ def save_token(user_id, access_token, refresh_token, expires_in):
         db.session.add(token_record)
         print(f"[+] New token saved for user_id: {user_id}")
     
-    db.session.commit()
+    if commit:
+        db.session.commit()
 
 
-def get_user_tokens(user_id):
-    token_record = Token.query.filter_by(user_id=user_id).first()
+def get_token_record(user_id):
+    """User ka Token row, ek hi query mein"""
+    return Token.query.filter_by(user_id=user_id).one_or_none()
+
+
+def get_user_tokens(user_id, token_record=None):
+    # Pass an already fetched token_record to skip the SELECT
+    if token_record is None:
+        token_record = get_token_record(user_id)
     
     if not token_record:
         return None
     
+    return token_record_to_dict(token_record)
+
+
+def token_record_to_dict(token_record):
     return {
         'access_token': decrypt_token(token_record.access_token),
         'refresh_token': decrypt_token(token_record.refresh_token) if token_record.refresh_token else None,
@@ -144,8 +281,27 @@ def get_user_tokens(user_id):
     }
 
 
-def is_token_expired(user_id):
-    token_record = Token.query.filter_by(user_id=user_id).first()
+def get_user_tokens_bulk(user_ids):
+    """Decrypted tokens for many users in one query, keyed by user_id"""
+    if not user_ids:
+        return {}
+    
+    token_records = Token.query.filter(Token.user_id.in_(user_ids)).all()
+    
+    return {record.user_id: token_record_to_dict(record) for record in token_records}
+
+
+def get_token_expiries_bulk(user_ids=None):
+    """{user_id: expires_at} without loading (or decrypting) the token columns"""
+    query = db.session.query(Token.user_id, Token.expires_at)
+    if user_ids is not None:
+        query = query.filter(Token.user_id.in_(user_ids))
+    return dict(query.all())
+
+
+def is_token_expired(user_id, token_record=None):
+    if token_record is None:
+        token_record = get_token_record(user_id)
     
     if not token_record:
         return True  
@@ -157,20 +313,104 @@ def get_all_users():
     return User.query.all()
 
 
+def get_users_page(offset=0, limit=50):
+    """
+    One page of users for the admin dashboard: admins first, then by name.
+    Plain rows of the displayed columns, no ORM objects are built
+    """
+    return db.session.query(
+        User.id, User.email, User.name, User.role, User.fetch_days
+    ).order_by(
+        db.case((User.role == 'admin', 0), else_=1),
+        db.func.lower(db.func.coalesce(User.name, '')),
+        User.id
+    ).offset(offset).limit(limit).all()
+
+
+def get_user_role_counts():
+    """{role: count} for users, counted in SQL and cached"""
+    global _role_counts_cache
+    now = time.monotonic()
+    cached = _role_counts_cache
+    if cached and now - cached[1] < USER_ROLE_COUNTS_TTL:
+        return dict(cached[0])
+    
+    counts = dict(
+        db.session.query(User.role, db.func.count())
+        .group_by(User.role).all()
+    )
+    _role_counts_cache = (counts, now)
+    return dict(counts)
+
+
+def invalidate_user_role_counts():
+    global _role_counts_cache
+    _role_counts_cache = None
+
+
+def get_users_with_tokens(user_ids=None):
+    """Users and their token rows in one joined query"""
+    query = User.query.options(db.joinedload(User.tokens))
+    if user_ids:
+        query = query.filter(User.id.in_(user_ids))
+    return query.all()
+
+
 def get_user_by_id(user_id):
-    return User.query.get(user_id)
+    return db.session.get(User, user_id)
+
+
+class CachedUser(namedtuple('CachedUser', 'id email name role')):
+    """Detached snapshot of a User; safe to share between requests"""
+    __slots__ = ()
+    
+    def is_admin(self):
+        return self.role == 'admin'
+
+
+def get_cached_user(user_id):
+    """CachedUser (None if missing), cached for USER_CACHE_TTL seconds"""
+    now = time.monotonic()
+    with _user_cache_lock:
+        cached = _user_cache.get(user_id)
+    if cached and now - cached[1] < USER_CACHE_TTL:
+        return cached[0]
+    
+    row = db.session.query(User.id, User.email, User.name, User.role).filter(User.id == user_id).first()
+    if row is None:
+        return None
+    user = CachedUser(*row)
+    with _user_cache_lock:
+        _user_cache[user_id] = (user, now)
+    return user
+
+
+def get_user_role(user_id):
+    """User ka role (None if missing), from the user cache"""
+    user = get_cached_user(user_id)
+    return user.role if user else None
 
 
-def create_scheduled_job(job_id, scheduled_time, user_ids, created_by):
+def invalidate_user_cache(user_id):
+    """Drop a cached user, e.g. after login, logout or a role change"""
+    with _user_cache_lock:
+        _user_cache.pop(user_id, None)
+
+
+def create_scheduled_job(job_id, scheduled_time, user_ids, created_by, commit=True):
+    # commit=False leaves the row pending so the caller can commit it together
+    # with registering the APScheduler job
     job = ScheduledJob(
         job_id=job_id,
         scheduled_time=scheduled_time,
-        user_ids=','.join(map(str, user_ids)) if user_ids else '',
+        user_ids=[int(uid) for uid in user_ids] if user_ids else [],
+        user_count=len(user_ids) if user_ids else 0,
         created_by=created_by,
         status='pending'
     )
     db.session.add(job)
-    db.session.commit()
+    if commit:
+        db.session.commit()
     return job
 
 
@@ -183,12 +423,41 @@ def update_job_status(job_id, status, completed_at=None):
         db.session.commit()
 
 
+def claim_job_run(job_id, run_date):
+    """
+    Insert the (job_id, run_date) row. False if another process already
+    inserted it, i.e. that run is already handled
+    """
+    db.session.add(JobRun(job_id=job_id, run_date=run_date))
+    try:
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback()
+        return False
+
+
 def get_pending_jobs():
-    return ScheduledJob.query.filter_by(status='pending').all()
+    return ScheduledJob.query.filter(
+        db.text(PENDING_JOBS_WHERE)
+    ).order_by(ScheduledJob.scheduled_time).all()
+
+
+def get_all_scheduled_jobs(limit=None):
+    query = ScheduledJob.query.options(
+        db.joinedload(ScheduledJob.creator)
+    ).order_by(ScheduledJob.created_at.desc())
+    if limit:
+        query = query.limit(limit)
+    return query.all()
 
 
-def get_all_scheduled_jobs():
-    return ScheduledJob.query.order_by(ScheduledJob.created_at.desc()).all()
+def get_job_status_counts():
+    """{status: count} for scheduled jobs, counted in SQL"""
+    return dict(
+        db.session.query(ScheduledJob.status, db.func.count())
+        .group_by(ScheduledJob.status).all()
+    )
 
 
 def cancel_scheduled_job(job_id):
@@ -202,20 +471,23 @@ def cancel_scheduled_job(job_id):
 
 def save_user_preference(user_id, fetch_days=None):
     """Save only fetch_days preference (timezone removed)"""
-    user = User.query.get(user_id)
-    if user:
-        if fetch_days is not None:
-            user.fetch_days = fetch_days
-            print(f"[+] Fetch days saved for user {user_id}: {fetch_days} days")
-        
-        db.session.commit()
-        return True
-    return False
+    if fetch_days is None:
+        return db.session.get(User, user_id) is not None
+    
+    # Direct UPDATE, like delete_old_logs: no SELECT, no ORM object loaded
+    updated = User.query.filter(User.id == user_id).update(
+        {'fetch_days': fetch_days}, synchronize_session=False
+    )
+    db.session.commit()
+    
+    if updated:
+        print(f"[+] Fetch days saved for user {user_id}: {fetch_days} days")
+    return updated > 0
 
 
 def get_user_preference(user_id):
     """Get only fetch_days preference (timezone removed)"""
-    user = User.query.get(user_id)
+    user = db.session.get(User, user_id)
     if user:
         return {
             'fetch_days': user.fetch_days or 7
@@ -223,7 +495,22 @@ def get_user_preference(user_id):
     return {'fetch_days': 7}
 
 
-def log_email_sent(user_id, user_email, user_name, subject, status, error_message=None, events_count=0, fetch_days=7):
+def log_email_sent(user_id, user_email, user_name, subject, status, error_message=None, events_count=0, fetch_days=7, batch=None):
+    if batch is not None:
+        # Collected by the caller and written later with log_email_sent_bulk
+        batch.append({
+            'user_id': user_id,
+            'user_email': user_email,
+            'user_name': user_name,
+            'subject': subject,
+            'status': status,
+            'error_message': error_message,
+            'events_count': events_count,
+            'fetch_days': fetch_days,
+            'sent_at': datetime.utcnow()
+        })
+        return None
+    
     try:
         log = EmailLog(
             user_id=user_id,
@@ -236,8 +523,10 @@ def log_email_sent(user_id, user_email, user_name, subject, status, error_messag
             fetch_days=fetch_days,
             sent_at=datetime.utcnow()
         )
-        db.session.add(log)
-        db.session.commit()
+        # Senders run on worker threads; serialize the SQLite writes
+        with _log_write_lock:
+            db.session.add(log)
+            db.session.commit()
         return log
     except Exception as e:
         print(f"[!] Failed to log email: {str(e)}")
@@ -245,7 +534,23 @@ def log_email_sent(user_id, user_email, user_name, subject, status, error_messag
         return None
 
 
-def get_email_logs(start_date=None, end_date=None, limit=100):
+def log_email_sent_bulk(rows):
+    """Insert many email log rows with a single commit"""
+    if not rows:
+        return 0
+    
+    try:
+        with _log_write_lock:
+            db.session.bulk_insert_mappings(EmailLog, rows)
+            db.session.commit()
+        return len(rows)
+    except Exception as e:
+        print(f"[!] Failed to log emails: {str(e)}")
+        db.session.rollback()
+        return 0
+
+
+def _email_logs_query(start_date=None, end_date=None, limit=100):
     query = EmailLog.query
     
     if start_date:
@@ -255,11 +560,20 @@ def get_email_logs(start_date=None, end_date=None, limit=100):
         end_date_extended = end_date + timedelta(days=1)
         query = query.filter(EmailLog.sent_at < end_date_extended)
     
-    return query.order_by(EmailLog.sent_at.desc()).limit(limit).all()
+    return query.order_by(EmailLog.sent_at.desc()).limit(limit)
+
+
+def get_email_logs(start_date=None, end_date=None, limit=100):
+    return _email_logs_query(start_date, end_date, limit).all()
+
+
+def iter_email_logs(start_date=None, end_date=None, limit=100, batch_size=500):
+    """Same rows as get_email_logs, fetched from the cursor batch_size at a time"""
+    return _email_logs_query(start_date, end_date, limit).yield_per(batch_size)
 
 
 def get_logs_stats(start_date=None, end_date=None):
-    query = EmailLog.query
+    query = db.session.query(EmailLog.status, db.func.count())
     
     if start_date:
         query = query.filter(EmailLog.sent_at >= start_date)
@@ -268,9 +582,11 @@ def get_logs_stats(start_date=None, end_date=None):
         end_date_extended = end_date + timedelta(days=1)
         query = query.filter(EmailLog.sent_at < end_date_extended)
     
-    total = query.count()
-    success = query.filter_by(status='success').count()
-    failed = query.filter_by(status='failed').count()
+    # One grouped scan instead of three separate COUNT(*) queries
+    counts = dict(query.group_by(EmailLog.status).all())
+    total = sum(counts.values())
+    success = counts.get('success', 0)
+    failed = counts.get('failed', 0)
     
     return {
         'total': total,
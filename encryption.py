@@ -1,5 +1,9 @@
 import os
+import base64
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -17,11 +21,33 @@ if not ENCRYPTION_KEY:
     print("=" * 60 + "\n")
 
 cipher = Fernet(ENCRYPTION_KEY.encode())
+
+# New tokens are stored as AESGCM_VERSION + nonce + ciphertext. Fernet tokens
+# always start with b'g', so old rows are still told apart and readable.
+# TOKEN_CIPHER=fernet switches writes back to Fernet.
+TOKEN_CIPHER = os.getenv("TOKEN_CIPHER", "aesgcm").lower()
+AESGCM_VERSION = b'\x01'
+AESGCM_NONCE_SIZE = 12
+
+_aesgcm_key = HKDF(
+    algorithm=hashes.SHA256(),
+    length=32,
+    salt=None,
+    info=b'schedule-ai token aes-gcm'
+).derive(base64.urlsafe_b64decode(ENCRYPTION_KEY.encode()))
+aesgcm = AESGCM(_aesgcm_key)
+
 def encrypt_token(token_string):
     if not token_string:
         return None
-    return cipher.encrypt(token_string.encode())
+    if TOKEN_CIPHER == 'fernet':
+        return cipher.encrypt(token_string.encode())
+    nonce = os.urandom(AESGCM_NONCE_SIZE)
+    return AESGCM_VERSION + nonce + aesgcm.encrypt(nonce, token_string.encode(), None)
 def decrypt_token(encrypted_token):
     if not encrypted_token:
         return None
+    if encrypted_token[:1] == AESGCM_VERSION:
+        nonce = encrypted_token[1:1 + AESGCM_NONCE_SIZE]
+        return aesgcm.decrypt(nonce, encrypted_token[1 + AESGCM_NONCE_SIZE:], None).decode()
     return cipher.decrypt(encrypted_token).decode()
\ No newline at end of file
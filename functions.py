@@ -1,19 +1,53 @@
-from datetime import datetime
-import pytz
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
 from flask import session, request, redirect, url_for, jsonify, render_template
-from functools import wraps
+from functools import wraps, lru_cache
+import logging
+import threading
+import time
 
 from database import (
-    get_user_by_id, get_user_tokens, is_token_expired, 
-    save_user_preference, get_email_logs, get_logs_stats,
-    create_scheduled_job, update_job_status, get_all_scheduled_jobs,
-    cancel_scheduled_job, ScheduledJob, User, db
+    get_user_role,
+    save_user_preference, get_email_logs, iter_email_logs, get_logs_stats,
+    create_scheduled_job, update_job_status, get_all_scheduled_jobs, get_job_status_counts,
+    cancel_scheduled_job, get_all_users, get_users_page, get_user_role_counts,
+    get_token_expiries_bulk, ScheduledJob, db
 )
-from agent import send_email_to_users
+from agent import send_email_to_users, USER_TIMEZONE, USER_TZ
 import csv
+import uuid
 from io import StringIO
 
 
+logger = logging.getLogger(__name__)
+
+# dashboard_admin.html only lists the most recent jobs
+DASHBOARD_JOBS_LIMIT = 10
+# Users per admin dashboard page
+DASHBOARD_USERS_PAGE_SIZE = 50
+
+# Built job rows for the dashboard, keyed by admin timezone. Cleared by every
+# job change made in this process; the TTL covers jobs finishing elsewhere
+DASHBOARD_JOBS_CACHE_TTL = 30
+_jobs_cache = {}
+_jobs_cache_lock = threading.Lock()
+
+
+@lru_cache(maxsize=8)
+def _admin_zone(admin_timezone):
+    # The configured zone comes from agent, which already fell back to UTC
+    if admin_timezone == USER_TIMEZONE:
+        return USER_TZ
+    return ZoneInfo(admin_timezone)
+
+
+def _utc_to_local(dt, admin_tz):
+    """Stored times are naive UTC; zoneinfo converts them in C, unlike pytz"""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(admin_tz)
+
+
 def admin_required(f):
     """Decorator: Admin-only access"""
     @wraps(f)
@@ -21,8 +55,9 @@ def admin_required(f):
         if 'user_id' not in session:
             return redirect(url_for('index'))
         
-        user = get_user_by_id(session['user_id'])
-        if not user or not user.is_admin():
+        if get_user_role(session['user_id']) != 'admin':
+            # No longer an admin: let /dashboard fall back to the user page
+            session.pop('is_admin', None)
             return render_template('error.html', 
                 error_title="[!] Access Denied",
                 error_message="You don't have admin privileges to access this page."
@@ -32,24 +67,31 @@ def admin_required(f):
     return decorated_function
 
 
-def get_dashboard_data(admin_timezone):
-    """Get all users and scheduled jobs for admin dashboard"""
-    users = User.query.all()
-    admins_count = sum(1 for u in users if u.is_admin())
-    users_count = len(users) - admins_count
+def invalidate_jobs_cache():
+    with _jobs_cache_lock:
+        _jobs_cache.clear()
+
+
+def _get_dashboard_jobs(admin_timezone):
+    """(jobs_data, pending_jobs_count) for the dashboard, cached briefly"""
+    now = time.monotonic()
+    with _jobs_cache_lock:
+        cached = _jobs_cache.get(admin_timezone)
+    if cached and now - cached[2] < DASHBOARD_JOBS_CACHE_TTL:
+        return cached[0], cached[1]
     
-    scheduled_jobs = get_all_scheduled_jobs()
-    pending_jobs_count = sum(1 for j in scheduled_jobs if j.status == 'pending')
+    # Jobs are only shown for the latest few, so count them in SQL and load just those
+    scheduled_jobs = get_all_scheduled_jobs(limit=DASHBOARD_JOBS_LIMIT)
+    pending_jobs_count = get_job_status_counts().get('pending', 0)
     
     jobs_data = []
-    admin_tz = pytz.timezone(admin_timezone)
+    admin_tz = _admin_zone(admin_timezone)
     
     for job in scheduled_jobs:
-        creator = get_user_by_id(job.created_by) if job.created_by else None
-        user_count = len(job.user_ids.split(',')) if job.user_ids else 'All users'
+        creator = job.creator
+        user_count = job.user_count or 'All users'
         
-        scheduled_time_utc = pytz.UTC.localize(job.scheduled_time) if job.scheduled_time.tzinfo is None else job.scheduled_time
-        scheduled_time_local = scheduled_time_utc.astimezone(admin_tz)
+        scheduled_time_local = _utc_to_local(job.scheduled_time, admin_tz)
         
         jobs_data.append({
             'job_id': job.job_id,
@@ -59,22 +101,43 @@ def get_dashboard_data(admin_timezone):
             'creator_name': creator.name if creator else 'Unknown'
         })
     
+    with _jobs_cache_lock:
+        _jobs_cache[admin_timezone] = (jobs_data, pending_jobs_count, now)
+    return jobs_data, pending_jobs_count
+
+
+def get_dashboard_data(admin_timezone, page=1, page_size=DASHBOARD_USERS_PAGE_SIZE):
+    """Get one page of users and the latest scheduled jobs for admin dashboard"""
+    # Counts come from SQL and only the current page of users is loaded;
+    # token status is fetched by the page afterwards (get_token_statuses)
+    role_counts = get_user_role_counts()
+    admins_count = role_counts.get('admin', 0)
+    total_users = sum(role_counts.values())
+    users_count = total_users - admins_count
+    
+    total_pages = max(1, -(-total_users // page_size))
+    page = min(max(page, 1), total_pages)
+    users = get_users_page(offset=(page - 1) * page_size, limit=page_size)
+    
+    jobs_data, pending_jobs_count = _get_dashboard_jobs(admin_timezone)
+    
     users_data = []
-    sorted_users = sorted(users, key=lambda u: (0 if u.is_admin() else 1, u.name.lower()))
     
-    for user in sorted_users:
+    # Already in display order (admins first, then by name) from SQL
+    for user in users:
         users_data.append({
             'id': user.id,
             'email': user.email,
             'name': user.name,
-            'is_admin': user.is_admin(),
-            'token_valid': not is_token_expired(user.id),
+            'is_admin': user.role == 'admin',
             'fetch_days': user.fetch_days or 7
         })
     
     return {
         'users': users_data,
-        'total_users': len(users),
+        'page': page,
+        'total_pages': total_pages,
+        'total_users': total_users,
         'admins_count': admins_count,
         'users_count': users_count,
         'scheduled_jobs': jobs_data,
@@ -82,17 +145,26 @@ def get_dashboard_data(admin_timezone):
     }
 
 
+def get_token_statuses(user_ids):
+    """{user_id: token still valid} for the dashboard badges; no decryption"""
+    now = datetime.utcnow()
+    token_expiries = get_token_expiries_bulk(user_ids)
+    return {
+        user_id: user_id in token_expiries and now <= token_expiries[user_id]
+        for user_id in user_ids
+    }
+
+
 def get_logs_data(admin_timezone, start_date=None, end_date=None, limit=500):
     """Get email logs with timezone conversion"""
     logs = get_email_logs(start_date=start_date, end_date=end_date, limit=limit)
     stats = get_logs_stats(start_date=start_date, end_date=end_date)
     
     logs_data = []
-    admin_tz = pytz.timezone(admin_timezone)
+    admin_tz = _admin_zone(admin_timezone)
     
     for log in logs:
-        sent_at_utc = pytz.UTC.localize(log.sent_at) if log.sent_at.tzinfo is None else log.sent_at
-        sent_at_local = sent_at_utc.astimezone(admin_tz)
+        sent_at_local = _utc_to_local(log.sent_at, admin_tz)
         
         logs_data.append({
             'id': log.id,
@@ -114,36 +186,42 @@ def get_logs_data(admin_timezone, start_date=None, end_date=None, limit=500):
 
 
 def export_logs_to_csv(admin_timezone, start_date=None, end_date=None, limit=5000):
-    """Export logs to CSV format"""
-    logs = get_email_logs(start_date=start_date, end_date=end_date, limit=limit)
-    
-    output = StringIO()
-    writer = csv.writer(output)
-    
-    writer.writerow(['ID', 'Date', 'Time', 'User Name', 'Email', 'Subject', 'Status', 'Events', 'Days', 'Error'])
+    """Export logs to CSV format, yielded a row at a time for a streamed response"""
+    admin_tz = _admin_zone(admin_timezone)
     
-    admin_tz = pytz.timezone(admin_timezone)
-    for log in logs:
-        sent_at_utc = pytz.UTC.localize(log.sent_at) if log.sent_at.tzinfo is None else log.sent_at
-        sent_at_local = sent_at_utc.astimezone(admin_tz)
+    def generate_rows():
+        output = StringIO()
+        writer = csv.writer(output)
+        
+        def flush():
+            chunk = output.getvalue()
+            output.seek(0)
+            output.truncate(0)
+            return chunk
+        
+        writer.writerow(['ID', 'Date', 'Time', 'User Name', 'Email', 'Subject', 'Status', 'Events', 'Days', 'Error'])
+        yield flush()
         
-        writer.writerow([
-            log.id,
-            sent_at_local.strftime('%Y-%m-%d'),
-            sent_at_local.strftime('%H:%M:%S'),
-            log.user_name,
-            log.user_email,
-            log.subject,
-            log.status,
-            log.events_count,
-            log.fetch_days,
-            log.error_message or ''
-        ])
+        for log in iter_email_logs(start_date=start_date, end_date=end_date, limit=limit):
+            sent_at_local = _utc_to_local(log.sent_at, admin_tz)
+            
+            writer.writerow([
+                log.id,
+                sent_at_local.strftime('%Y-%m-%d'),
+                sent_at_local.strftime('%H:%M:%S'),
+                log.user_name,
+                log.user_email,
+                log.subject,
+                log.status,
+                log.events_count,
+                log.fetch_days,
+                log.error_message or ''
+            ])
+            yield flush()
     
-    output.seek(0)
     filename = f"email_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
     
-    return output.getvalue(), filename
+    return generate_rows(), filename
 
 
 def save_user_preferences(user_id, fetch_days=None):
@@ -164,33 +242,110 @@ def save_user_preferences(user_id, fetch_days=None):
         return False, str(e)
 
 
-def send_emails_to_selected_users(user_ids, fetch_days=7):
-    """Send emails to selected users"""
+# Jobs live in a persistent job store, so they must be plain module-level
+# functions with picklable args; the Flask app they run under is set once
+_job_app = None
+
+
+def init_job_runner(app):
+    """Register the app that background/scheduled jobs run under"""
+    global _job_app
+    _job_app = app
+
+
+def run_email_send(job_id, user_ids=None, fetch_days=7, include_admins=True):
+    """Background 'send now' job"""
+    with _job_app.app_context():
+        try:
+            result = send_email_to_users(
+                user_ids=user_ids,
+                broadcast_from_user_id=None,
+                include_admins=include_admins,
+                fetch_days_ahead=fetch_days
+            )
+            logger.info("[+] Background send %s finished: %s", job_id, result)
+        except Exception as e:
+            logger.error("[!] Background send %s failed: %s", job_id, e)
+        finally:
+            db.session.expunge_all()
+            db.session.remove()
+
+
+def run_scheduled_email_job(job_id, user_ids, fetch_days):
+    """Job added by schedule_email_job"""
+    with _job_app.app_context():
+        try:
+            logger.info("\n[*] EXECUTING SCHEDULED JOB: %s", job_id)
+            
+            if user_ids:
+                result = send_email_to_users(
+                    user_ids=[int(uid) for uid in user_ids],
+                    broadcast_from_user_id=None,
+                    include_admins=True,
+                    fetch_days_ahead=fetch_days
+                )
+            else:
+                result = send_email_to_users(
+                    user_ids=None,
+                    broadcast_from_user_id=None,
+                    include_admins=False,
+                    fetch_days_ahead=fetch_days
+                )
+            
+            update_job_status(job_id, 'completed', datetime.utcnow())
+            logger.info("[+] Scheduled job completed: %s", result)
+            
+        except Exception as e:
+            logger.error("[!] Scheduled job failed: %s", e)
+            update_job_status(job_id, 'failed', datetime.utcnow())
+        
+        finally:
+            invalidate_jobs_cache()
+            # Don't let this run's rows linger in the identity map
+            db.session.expunge_all()
+            db.session.remove()
+
+
+def queue_email_send(scheduler, user_ids=None, fetch_days=7, include_admins=True):
+    """
+    Run send_email_to_users on the scheduler's thread pool instead of inside
+    the request. Returns the background job id straight away.
+    """
+    job_id = f"send_now_{uuid.uuid4().hex[:12]}"
+    
+    # No trigger = run once, now
+    scheduler.add_job(
+        func=run_email_send,
+        args=[job_id, user_ids, fetch_days, include_admins],
+        id=job_id,
+        name=f'Send Now ({len(user_ids) if user_ids else "all"} users)',
+        misfire_grace_time=None
+    )
+    return job_id
+
+
+def send_emails_to_selected_users(scheduler, user_ids, fetch_days=7):
+    """Queue emails to selected users; returns (success, message, job_id)"""
     if not user_ids:
-        return False, 'No users selected'
+        return False, 'No users selected', None
     
     try:
         fetch_days = int(fetch_days)
         if fetch_days < 1 or fetch_days > 365:
-            return False, 'Days must be between 1 and 365'
+            return False, 'Days must be between 1 and 365', None
     except (ValueError, TypeError):
-        return False, 'Invalid days value'
+        return False, 'Invalid days value', None
     
     try:
         user_ids = [int(uid) for uid in user_ids]
-        result = send_email_to_users(
-            user_ids=user_ids, 
-            broadcast_from_user_id=None, 
-            include_admins=True,
-            fetch_days_ahead=fetch_days
-        )
-        message = f'✅ Emails sent! Success: {result["success"]}, Failed: {result["failed"]}'
-        return True, message
+        job_id = queue_email_send(scheduler, user_ids=user_ids, fetch_days=fetch_days)
+        message = f'✅ Sending to {len(user_ids)} user(s) in the background. Check Logs for results.'
+        return True, message, job_id
     except Exception as e:
-        return False, str(e)
+        return False, str(e), None
 
 
-def schedule_email_job(scheduler, app, datetime_str, admin_timezone, user_ids, fetch_days, created_by_user_id):
+def schedule_email_job(scheduler, datetime_str, admin_timezone, user_ids, fetch_days, created_by_user_id):
     """Schedule email job for future delivery"""
     try:
         fetch_days = int(fetch_days)
@@ -201,59 +356,43 @@ def schedule_email_job(scheduler, app, datetime_str, admin_timezone, user_ids, f
     
     try:
         scheduled_dt = datetime.strptime(datetime_str, '%Y-%m-%dT%H:%M')
-        admin_tz = pytz.timezone(admin_timezone)
-        scheduled_dt = admin_tz.localize(scheduled_dt)
-        scheduled_dt_utc = scheduled_dt.astimezone(pytz.UTC)
+        scheduled_dt = scheduled_dt.replace(tzinfo=_admin_zone(admin_timezone))
+        scheduled_dt_utc = scheduled_dt.astimezone(timezone.utc)
         
-        if scheduled_dt_utc <= datetime.now(pytz.UTC):
+        if scheduled_dt_utc <= datetime.now(timezone.utc):
             return False, '⚠️ Please select a future date & time!'
         
         job_id = f"scheduled_{int(scheduled_dt_utc.timestamp())}_{created_by_user_id}"
         
-        def send_scheduled_emails():
-            with app.app_context():
-                try:
-                    print(f"\n[*] EXECUTING SCHEDULED JOB: {job_id}")
-                    
-                    if user_ids:
-                        result = send_email_to_users(
-                            user_ids=[int(uid) for uid in user_ids],
-                            broadcast_from_user_id=None,
-                            include_admins=True,
-                            fetch_days_ahead=fetch_days
-                        )
-                    else:
-                        result = send_email_to_users(
-                            user_ids=None,
-                            broadcast_from_user_id=None,
-                            include_admins=False,
-                            fetch_days_ahead=fetch_days
-                        )
-                    
-                    update_job_status(job_id, 'completed', datetime.utcnow())
-                    print(f"[+] Scheduled job completed: {result}")
-                    
-                except Exception as e:
-                    print(f"[!] Scheduled job failed: {str(e)}")
-                    update_job_status(job_id, 'failed', datetime.utcnow())
-        
         from apscheduler.triggers.date import DateTrigger
         
+        # Scheduler entry first (the job store commits on its own connection,
+        # and a duplicate job_id is refused here), then the row with one
+        # commit; if the row fails the entry is taken back out
         scheduler.add_job(
-            func=send_scheduled_emails,
+            func=run_scheduled_email_job,
+            args=[job_id, [int(uid) for uid in user_ids] if user_ids else [], fetch_days],
             trigger=DateTrigger(run_date=scheduled_dt_utc),
             id=job_id,
             name=f'Scheduled Email @ {scheduled_dt}',
-            replace_existing=True
-        )
-        
-        create_scheduled_job(
-            job_id=job_id,
-            scheduled_time=scheduled_dt_utc,
-            user_ids=user_ids if user_ids else [],
-            created_by=created_by_user_id
+            # Still send if the server was down at the scheduled minute
+            misfire_grace_time=3600
         )
+        try:
+            create_scheduled_job(
+                job_id=job_id,
+                scheduled_time=scheduled_dt_utc,
+                user_ids=user_ids if user_ids else [],
+                created_by=created_by_user_id,
+                commit=False
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            scheduler.remove_job(job_id)
+            raise
         
+        invalidate_jobs_cache()
         message = f'✅ Email scheduled for {scheduled_dt.strftime("%Y-%m-%d %H:%M")} {admin_timezone}!'
         return True, message
         
@@ -266,6 +405,7 @@ def cancel_job(scheduler, job_id):
     try:
         scheduler.remove_job(job_id)
         cancel_scheduled_job(job_id)
+        invalidate_jobs_cache()
         return True, '✅ Job cancelled!'
     except Exception as e:
         return False, str(e)
@@ -274,16 +414,13 @@ def cancel_job(scheduler, job_id):
 def clear_completed_jobs():
     """Clear all completed/failed/cancelled jobs from database"""
     try:
-        completed_jobs = ScheduledJob.query.filter(
+        # Single DELETE ... WHERE status IN (...), like delete_old_logs
+        count = ScheduledJob.query.filter(
             ScheduledJob.status.in_(['completed', 'failed', 'cancelled'])
-        ).all()
-        
-        count = len(completed_jobs)
-        
-        for job in completed_jobs:
-            db.session.delete(job)
+        ).delete(synchronize_session=False)
         
         db.session.commit()
+        invalidate_jobs_cache()
         return True, f'✅ Cleared {count} job(s)!'
         
     except Exception as e:
@@ -293,7 +430,9 @@ def clear_completed_jobs():
 
 def get_debug_info(admin_timezone):
     """Get debug information about all users"""
-    users = User.query.all()
+    users = get_all_users()
+    token_expiries = get_token_expiries_bulk()
+    now = datetime.utcnow()
     
     output = []
     output.append("=" * 60)
@@ -310,9 +449,9 @@ def get_debug_info(admin_timezone):
         output.append(f"Role: {user.role.upper()}")
         output.append(f"Fetch Days: {user.fetch_days or 7}")
         
-        tokens = get_user_tokens(user.id)
-        if tokens:
-            is_exp = is_token_expired(user.id)
+        expires_at = token_expiries.get(user.id)
+        if expires_at:
+            is_exp = now > expires_at
             status = "EXPIRED" if is_exp else "VALID"
             output.append(f"Token Status: {status}")
         else:
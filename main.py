@@ -1,59 +1,214 @@
 import os
+import atexit
+import logging
+import queue
+import time
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
 import requests
-from datetime import datetime, timedelta
-from flask import Flask, request, redirect, session, url_for, jsonify, render_template
+from datetime import date, datetime, timedelta, timezone
+from flask import Flask, Response, request, redirect, session, url_for, jsonify, render_template, stream_with_context
 from requests_oauthlib import OAuth2Session
+from oauthlib.common import generate_token
+from oauthlib.oauth2 import WebApplicationClient
 from dotenv import load_dotenv
+from flask.json.provider import DefaultJSONProvider
+from jinja2 import FileSystemBytecodeCache
+import orjson
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.triggers.cron import CronTrigger
-import pytz
 
 from database import (
-    db, get_or_create_user, save_token, get_user_by_id, User
+    db, get_or_create_user, save_token, get_cached_user, invalidate_user_cache, User, upgrade_schema,
+    claim_job_run, invalidate_user_role_counts
 )
 
-from utils import GOOGLE_CLIENT_ID as GOOGLE_CLIENT_ID_UTIL
-from agent import run_daily_summary_agent
+from utils import GOOGLE_CLIENT_ID as GOOGLE_CLIENT_ID_UTIL, OAUTH_HTTP_ADAPTER, invalidate_cached_token
+# USER_TZ falls back to UTC if USER_TIMEZONE is unknown, in one place
+from agent import run_daily_summary_agent, USER_TIMEZONE, USER_TZ
 
 from functions import (
     admin_required, get_dashboard_data, get_logs_data, export_logs_to_csv,
-    save_user_preferences, send_emails_to_selected_users,
-    schedule_email_job, cancel_job, clear_completed_jobs, get_debug_info
+    save_user_preferences, send_emails_to_selected_users, queue_email_send, init_job_runner,
+    schedule_email_job, cancel_job, clear_completed_jobs, get_debug_info, get_token_statuses,
+    DASHBOARD_USERS_PAGE_SIZE
 )
 
 load_dotenv()
 
+# Everything logs through the logging module; LOG_LEVEL=WARNING quiets per-user
+# output. Request and worker threads only put records on a queue, the
+# listener thread does the actual writing to stderr
+_log_queue = queue.Queue(-1)
+# QueueHandler formats the message before queueing it, so the format is set there
+_log_listener = QueueListener(_log_queue, logging.StreamHandler())
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(message)s",
+    handlers=[QueueHandler(_log_queue)]
+)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+# APScheduler logs "Running job" / "executed successfully" at INFO for every
+# run, including the 30 s job store poll; email jobs log their own results
+logging.getLogger('apscheduler.executors').setLevel(logging.WARNING)
+
+logger = logging.getLogger(__name__)
+_BAR = "=" * 60
+
+class ORJSONProvider(DefaultJSONProvider):
+    """
+    jsonify() and request.get_json() through orjson; Flask's own default()
+    still handles odd types
+    """
+    
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+    
+    def loads(self, s, **kwargs):
+        # orjson.JSONDecodeError is a ValueError, so bad bodies still get a 400
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY")
+app.json = ORJSONProvider(app)
+
+# Compiled templates are written to disk and reused by every process and
+# after restarts; templates aren't re-stat'ed per render unless asked for
+JINJA_CACHE_DIR = os.getenv("JINJA_CACHE_DIR")
+
+
+def _jinja_bytecode_cache():
+    """
+    Cached bytecode is loaded as code, so the directory must be private.
+    Without JINJA_CACHE_DIR, Jinja makes a per-user 0700 temp dir itself
+    """
+    if not JINJA_CACHE_DIR:
+        return FileSystemBytecodeCache()
+    
+    os.makedirs(JINJA_CACHE_DIR, mode=0o700, exist_ok=True)
+    if hasattr(os, 'getuid') and os.stat(JINJA_CACHE_DIR).st_uid != os.getuid():
+        logger.warning("[!] JINJA_CACHE_DIR %s is owned by another user, using the default cache", JINJA_CACHE_DIR)
+        return FileSystemBytecodeCache()
+    return FileSystemBytecodeCache(JINJA_CACHE_DIR)
+
+
+# Set before app.jinja_env is first touched, which is when Flask reads it
+app.config['TEMPLATES_AUTO_RELOAD'] = os.getenv("TEMPLATES_AUTO_RELOAD", "0") == "1"
+app.jinja_env.bytecode_cache = _jinja_bytecode_cache()
+# Load every template now so the first request to each page doesn't pay for it
+for _template_name in app.jinja_env.list_templates():
+    app.jinja_env.get_template(_template_name)
 
 db_path = os.path.join(os.getcwd(), 'tokens.db')
 app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{db_path}'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Web requests, the scheduler and send workers share pooled connections;
+# WAL and the other pragmas are set per connection in database.py
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+    'pool_size': 10,
+    'max_overflow': 20,
+    'pool_pre_ping': True,
+    'pool_recycle': 1800,
+    # Room for every distinct ORM statement the app builds, so none fall
+    # out of the compiled-SQL cache and get recompiled
+    'query_cache_size': 1200,
+    'connect_args': {'check_same_thread': False, 'timeout': 30}
+}
 
 db.init_app(app)
 
-USER_TIMEZONE = os.getenv("USER_TIMEZONE", "UTC")
 
-scheduler = BackgroundScheduler(timezone=pytz.UTC)
+# How often the job-running process looks for jobs added by other processes
+SCHEDULER_POLL_SECONDS = int(os.getenv("SCHEDULER_POLL_SECONDS", "30"))
+
+# Threads available to queued and scheduled email jobs
+SCHEDULER_MAX_WORKERS = int(os.getenv("SCHEDULER_MAX_WORKERS", "8"))
+
+with app.app_context():
+    _jobstore_engine = db.engine
+
+# Email jobs are kept in tokens.db so every process (Waitress workers, a
+# restarted server) sees the same jobs; the cron job is re-added on every
+# start so it stays in memory
+scheduler = BackgroundScheduler(
+    jobstores={
+        'default': SQLAlchemyJobStore(engine=_jobstore_engine),
+        'memory': MemoryJobStore()
+    },
+    executors={'default': ThreadPoolExecutor(max_workers=SCHEDULER_MAX_WORKERS)},
+    timezone=timezone.utc
+)
+init_job_runner(app)
+
+
+def _acquire_scheduler_lock(lock_path):
+    """Non-blocking file lock; only the process holding it runs jobs"""
+    lock_file = open(lock_path, 'a+')
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    # Kept open for the life of the process; the OS drops the lock on exit
+    return lock_file
+
+
+def _poll_job_store():
+    """No-op; running it makes the scheduler re-read the shared job store"""
 
 def scheduled_job():
     """Midnight UTC job"""
-    print(f"\n{'='*60}")
-    print(f"[*] SCHEDULED JOB TRIGGERED at {datetime.now(pytz.UTC)}")
-    print(f"{'='*60}\n")
+    run_time = datetime.now(timezone.utc)
+    logger.info("\n%s\n[*] SCHEDULED JOB TRIGGERED at %s\n%s\n", _BAR, run_time, _BAR)
     
     with app.app_context():
-        run_daily_summary_agent()
+        try:
+            # Backstop for the scheduler lock: if two processes fire the cron
+            # job anyway, only the one that claims today's row sends emails
+            if not claim_job_run('daily_summary_job', run_time.date()):
+                logger.info("[*] daily_summary_job already ran for %s, skipping", run_time.date())
+                return
+            run_daily_summary_agent()
+        finally:
+            db.session.expunge_all()
+            db.session.remove()
 
 scheduler.add_job(
     func=scheduled_job,
-    trigger=CronTrigger(hour=0, minute=0, timezone=pytz.UTC),
+    trigger=CronTrigger(hour=0, minute=0, timezone=timezone.utc),
     id='daily_summary_job',
     name='Send Daily Calendar Summary',
+    jobstore='memory',
     replace_existing=True
 )
 
-scheduler.start()
+_scheduler_lock = _acquire_scheduler_lock(db_path + '.scheduler.lock')
+if _scheduler_lock:
+    scheduler.add_job(
+        func=_poll_job_store,
+        trigger='interval',
+        seconds=SCHEDULER_POLL_SECONDS,
+        id='job_store_poll',
+        jobstore='memory'
+    )
+    scheduler.start()
+else:
+    # Another process runs the jobs; this one only adds/removes them
+    scheduler.start(paused=True)
+    logger.info("[*] Scheduler: jobs run in another process")
 
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
@@ -73,8 +228,19 @@ SCOPES = [
 
 REDIRECT_URI = os.getenv("REDIRECT_URI", "http://127.0.0.1:5000/callback")
 
-print(f"[*] OAuth Redirect URI: {REDIRECT_URI}")
-print(f"[*] OAuth Scopes: {len(SCOPES)} scopes configured")
+# Everything in the authorization URL except the CSRF state is fixed, so
+# build it once; /login only appends a fresh state
+AUTHORIZATION_URL_NO_STATE = WebApplicationClient(GOOGLE_CLIENT_ID).prepare_request_uri(
+    AUTHORIZATION_BASE_URL,
+    redirect_uri=REDIRECT_URI,
+    scope=SCOPES,
+    access_type="offline",
+    prompt="consent",
+    include_granted_scopes='true'
+)
+
+logger.info("[*] OAuth Redirect URI: %s", REDIRECT_URI)
+logger.info("[*] OAuth Scopes: %d scopes configured", len(SCOPES))
 
 
 @app.route("/")
@@ -89,29 +255,16 @@ def index():
 @app.route("/login")
 def login():
     """Google OAuth login"""
-    google = OAuth2Session(
-        GOOGLE_CLIENT_ID, 
-        scope=SCOPES,
-        redirect_uri=REDIRECT_URI
-    )
-    
-    authorization_url, state = google.authorization_url(
-        AUTHORIZATION_BASE_URL,
-        access_type="offline",
-        prompt="consent",
-        include_granted_scopes='true'
-    )
+    # Same token OAuth2Session would generate; only URL-safe characters
+    state = generate_token()
+    authorization_url = f"{AUTHORIZATION_URL_NO_STATE}&state={state}"
     
     session['oauth_state'] = state
     
-    print("\n" + "="*60)
-    print("🔐 OAuth Login Initiated")
-    print("="*60)
-    print(f"Scopes requested: {len(SCOPES)}")
-    for i, scope in enumerate(SCOPES, 1):
-        scope_name = scope.split('/')[-1] if '/' in scope else scope
-        print(f"  {i}. {scope_name}")
-    print("="*60 + "\n")
+    logger.info("🔐 OAuth Login Initiated (%d scopes requested)", len(SCOPES))
+    if logger.isEnabledFor(logging.DEBUG):
+        for i, scope in enumerate(SCOPES, 1):
+            logger.debug("  %d. %s", i, scope.split('/')[-1] if '/' in scope else scope)
     
     return redirect(authorization_url)
 
@@ -119,71 +272,99 @@ def login():
 @app.route("/callback")
 def callback():
     """OAuth callback handler"""
+    # Both Google round trips finish before the DB is touched, so no pooled
+    # connection sits idle while we wait on them
     try:
         google = OAuth2Session(
             GOOGLE_CLIENT_ID, 
             redirect_uri=REDIRECT_URI, 
             state=session.get('oauth_state')
         )
+        # Reuse pooled keep-alive connections instead of a fresh TLS handshake per login
+        google.mount('https://', OAUTH_HTTP_ADAPTER)
         
+        started = time.perf_counter()
         token = google.fetch_token(
             TOKEN_URL,
             client_secret=GOOGLE_CLIENT_SECRET,
             authorization_response=request.url
         )
-        
-        print("\n" + "="*60)
-        print("[+] Token received from Google")
-        print("="*60)
-        print(f"Access Token: {'✅ Received' if token.get('access_token') else '❌ Missing'}")
-        print(f"Refresh Token: {'✅ Received' if token.get('refresh_token') else '❌ Missing'}")
-        print(f"Expires In: {token.get('expires_in', 0)} seconds")
+        token_exchange_ms = (time.perf_counter() - started) * 1000
         
         token_scope = token.get('scope', '')
         gmail_send_present = 'gmail.send' in token_scope
-        print(f"Gmail Send Scope: {'✅ GRANTED' if gmail_send_present else '❌ MISSING'}")
-        print("="*60 + "\n")
+        # One record so concurrent logins don't interleave
+        logger.info(
+            "\n%s\n[+] Token received from Google\n%s\n"
+            "Access Token: %s\nRefresh Token: %s\nExpires In: %s seconds\nGmail Send Scope: %s\n%s\n",
+            _BAR, _BAR,
+            '✅ Received' if token.get('access_token') else '❌ Missing',
+            '✅ Received' if token.get('refresh_token') else '❌ Missing',
+            token.get('expires_in', 0),
+            '✅ GRANTED' if gmail_send_present else '❌ MISSING',
+            _BAR
+        )
         
         if not gmail_send_present:
-            print("⚠️ WARNING: Gmail send scope NOT granted!")
-            print("⚠️ User will NOT be able to send emails!")
-            print("⚠️ This usually means:")
-            print("    1. Scope not in SCOPES list")
-            print("    2. Gmail API not enabled in Google Cloud")
-            print("    3. App not verified by Google")
+            logger.warning(
+                "⚠️ WARNING: Gmail send scope NOT granted!\n"
+                "⚠️ User will NOT be able to send emails!\n"
+                "⚠️ This usually means:\n"
+                "    1. Scope not in SCOPES list\n"
+                "    2. Gmail API not enabled in Google Cloud\n"
+                "    3. App not verified by Google"
+            )
         
+        started = time.perf_counter()
         user_info_response = google.get(USERINFO_URL)
         
         if user_info_response.status_code != 200:
             return "Error fetching user info from Google", 500
         
         user_info = user_info_response.json()
+        userinfo_fetch_ms = (time.perf_counter() - started) * 1000
         user_email = user_info.get('email')
         user_name = user_info.get('name', 'Unknown')
         
-        print(f"[*] User Email: {user_email}")
-        print(f"[*] User Name: {user_name}")
+        logger.info("[*] User: %s (%s)", user_name, user_email)
         
-        user = get_or_create_user(user_email, user_name)
+        # User + token in one transaction, one commit
+        started = time.perf_counter()
+        try:
+            user = get_or_create_user(user_email, user_name, commit=False)
+            
+            save_token(
+                user_id=user.id,
+                access_token=token.get('access_token'),
+                refresh_token=token.get('refresh_token'),
+                expires_in=token.get('expires_in', 3600),
+                commit=False
+            )
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        db_upsert_ms = (time.perf_counter() - started) * 1000
+        invalidate_cached_token(user.id)
+        invalidate_user_cache(user.id)
+        invalidate_user_role_counts()
         
-        save_token(
-            user_id=user.id,
-            access_token=token.get('access_token'),
-            refresh_token=token.get('refresh_token'),
-            expires_in=token.get('expires_in', 3600)
+        logger.info(
+            "[*] Callback timings: token_exchange=%.0fms userinfo_fetch=%.0fms db_upsert=%.0fms",
+            token_exchange_ms, userinfo_fetch_ms, db_upsert_ms
         )
-        
-        print(f"[+] Tokens saved for user_id: {user.id} ({user.role})")
-        print("="*60 + "\n")
+        logger.info("[+] Tokens saved for user_id: %s (%s)\n%s\n", user.id, user.role, _BAR)
         
         session['user_id'] = user.id
+        # Lets /dashboard pick admin vs user without a DB read
+        session['is_admin'] = user.is_admin()
         session.pop('oauth_token', None)
         session.pop('oauth_state', None)
         
         return redirect(url_for('dashboard'))
         
     except Exception as e:
-        print(f"[!] Error in callback: {str(e)}")
+        logger.error("[!] Error in callback: %s", e)
         return f"<h1>Authentication Error</h1><p>{str(e)}</p><a href='/'>Go Home</a>", 500
 
 
@@ -193,13 +374,18 @@ def dashboard():
     if 'user_id' not in session:
         return redirect(url_for('index'))
     
-    user = get_user_by_id(session['user_id'])
+    # admin_required re-checks the role, so a stale flag can't grant access
+    if session.get('is_admin'):
+        return redirect(url_for('admin_panel'))
+    
+    user = get_cached_user(session['user_id'])
     
     if not user:
         session.clear()
         return redirect(url_for('index'))
     
     if user.is_admin():
+        session['is_admin'] = True
         return redirect(url_for('admin_panel'))
     
     return render_template('dashboard_user.html', user=user)
@@ -209,11 +395,13 @@ def dashboard():
 @admin_required
 def admin_panel():
     """Admin panel with scheduling and user preferences"""
-    dashboard_data = get_dashboard_data(USER_TIMEZONE)
-    admin_tz = pytz.timezone(USER_TIMEZONE)
+    page = request.args.get('page', 1, type=int)
+    dashboard_data = get_dashboard_data(USER_TIMEZONE, page=page)
     
     return render_template('dashboard_admin.html',
         users=dashboard_data['users'],
+        page=dashboard_data['page'],
+        total_pages=dashboard_data['total_pages'],
         total_users=dashboard_data['total_users'],
         admins_count=dashboard_data['admins_count'],
         users_count=dashboard_data['users_count'],
@@ -221,10 +409,22 @@ def admin_panel():
         pending_jobs_count=dashboard_data['pending_jobs_count'],
         timezone=USER_TIMEZONE,
         fetch_days=7,
-        now=datetime.now(admin_tz).strftime('%Y-%m-%d %H:%M:%S')
+        now=datetime.now(USER_TZ).strftime('%Y-%m-%d %H:%M:%S')
     )
 
 
+@lru_cache(maxsize=512)
+def _parse_ymd(date_str):
+    """'YYYY-MM-DD' query arg -> naive midnight datetime, None if missing or invalid"""
+    # date.fromisoformat also takes '20260101' and '2026-W01-1' on 3.11+
+    if not date_str or len(date_str) != 10 or date_str[4] != '-' or date_str[7] != '-':
+        return None
+    try:
+        return datetime.combine(date.fromisoformat(date_str), datetime.min.time())
+    except ValueError:
+        return None
+
+
 @app.route("/logs")
 @admin_required
 def view_logs():
@@ -232,20 +432,8 @@ def view_logs():
     start_date_str = request.args.get('start_date')
     end_date_str = request.args.get('end_date')
     
-    start_date = None
-    end_date = None
-    
-    if start_date_str:
-        try:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-        except:
-            pass
-    
-    if end_date_str:
-        try:
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
-        except:
-            pass
+    start_date = _parse_ymd(start_date_str)
+    end_date = _parse_ymd(end_date_str)
     
     logs_data = get_logs_data(USER_TIMEZONE, start_date=start_date, end_date=end_date)
     
@@ -266,27 +454,17 @@ def export_logs_csv():
     start_date_str = request.args.get('start_date')
     end_date_str = request.args.get('end_date')
     
-    start_date = None
-    end_date = None
-    
-    if start_date_str:
-        try:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-        except:
-            pass
-    
-    if end_date_str:
-        try:
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
-        except:
-            pass
+    start_date = _parse_ymd(start_date_str)
+    end_date = _parse_ymd(end_date_str)
     
-    csv_content, filename = export_logs_to_csv(USER_TIMEZONE, start_date=start_date, end_date=end_date)
+    csv_rows, filename = export_logs_to_csv(USER_TIMEZONE, start_date=start_date, end_date=end_date)
     
-    return csv_content, 200, {
-        'Content-Type': 'text/csv',
-        'Content-Disposition': f'attachment; filename={filename}'
-    }
+    # Streamed so a large export never sits in memory as one string
+    return Response(
+        stream_with_context(csv_rows),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
 
 
 @app.route("/api/save_user_preference", methods=['POST'])
@@ -305,7 +483,7 @@ def api_save_user_preference():
     fetch_days = data.get('fetch_days')
     # ❌ REMOVED: timezone = data.get('timezone')
     
-    user = get_user_by_id(session['user_id'])
+    user = get_cached_user(session['user_id'])
     if not user:
         return jsonify({'success': False, 'message': 'User not found'}), 404
     
@@ -332,10 +510,11 @@ def api_send_to_selected():
     user_ids = data.get('user_ids', [])
     fetch_days = data.get('fetch_days', 7)
     
-    success, message = send_emails_to_selected_users(user_ids, fetch_days)
+    success, message, job_id = send_emails_to_selected_users(scheduler, user_ids, fetch_days)
     
     if success:
-        return jsonify({'success': True, 'message': message})
+        # 202: accepted, the actual sending happens on the scheduler's threads
+        return jsonify({'success': True, 'message': message, 'task_id': job_id, 'status': 'queued'}), 202
     else:
         return jsonify({'success': False, 'message': f'❌ Error: {message}'}), 500
 
@@ -355,6 +534,24 @@ def api_test_token(user_id):
         return jsonify({'success': False, 'message': f'❌ Error: {str(e)}'}), 500
 
 
+@app.route("/api/test_tokens_bulk", methods=['POST'])
+@admin_required
+def api_test_tokens_bulk():
+    """Token validity for many users in one call (dashboard badges)"""
+    data = request.get_json(silent=True) or {}
+    try:
+        user_ids = [int(uid) for uid in data.get('user_ids', [])]
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'message': 'Invalid user ids'}), 400
+    
+    # The dashboard asks for one page at a time; keeps the IN (...) bounded
+    if len(user_ids) > DASHBOARD_USERS_PAGE_SIZE:
+        return jsonify({'success': False, 'message': f'At most {DASHBOARD_USERS_PAGE_SIZE} user ids per request'}), 400
+    
+    statuses = get_token_statuses(user_ids)
+    return jsonify({'success': True, 'tokens': {str(uid): valid for uid, valid in statuses.items()}})
+
+
 @app.route("/api/schedule_email", methods=['POST'])
 @admin_required
 def api_schedule_email():
@@ -375,7 +572,6 @@ def api_schedule_email():
     
     success, message = schedule_email_job(
         scheduler, 
-        app, 
         datetime_str, 
         USER_TIMEZONE, 
         user_ids, 
@@ -429,8 +625,6 @@ def api_clear_completed_jobs():
 @admin_required
 def trigger_agent():
     """Manual trigger for all users"""
-    from agent import send_email_to_users
-    
     fetch_days = request.args.get('days', 7, type=int)
     
     if fetch_days < 1 or fetch_days > 365:
@@ -439,23 +633,15 @@ def trigger_agent():
             error_message="Days must be between 1 and 365"
         )
     
-    print("\n" + "="*60)
-    print("[*] MANUAL AGENT TRIGGER")
-    print("="*60 + "\n")
+    logger.info("\n%s\n[*] MANUAL AGENT TRIGGER\n%s\n", _BAR, _BAR)
     
     try:
-        results = send_email_to_users(
-            user_ids=None, 
-            broadcast_from_user_id=None, 
-            include_admins=False,
-            fetch_days_ahead=fetch_days
-        )
+        queue_email_send(scheduler, user_ids=None, fetch_days=fetch_days, include_admins=False)
         
         return render_template('success.html',
-            title=f"✅ Emails Sent ({fetch_days} days)!",
-            message="Each user received their own calendar events",
-            stats=results
-        )
+            title=f"✅ Emails Queued ({fetch_days} days)!",
+            message="Each user will receive their own calendar events. Check Logs for results."
+        ), 202
         
     except Exception as e:
         return render_template('error.html',
@@ -468,9 +654,12 @@ def trigger_agent():
 def logout():
     user_id = session.get('user_id')
     if user_id:
-        user = get_user_by_id(user_id)
-        if user:
-            print(f"[*] {user.role.upper()} {user.email} logged out")
+        # The lookup is only for the log line
+        if logger.isEnabledFor(logging.INFO):
+            user = get_cached_user(user_id)
+            if user:
+                logger.info("[*] %s %s logged out", user.role.upper(), user.email)
+        invalidate_user_cache(user_id)
     
     session.clear()
     return redirect(url_for('index'))
@@ -488,19 +677,24 @@ if __name__ == "__main__":
     
     with app.app_context():
         db.create_all()
-        print("\n" + "=" * 60)
-        print("[+] Database tables ready!")
-        print("=" * 60)
+        upgrade_schema()
+        logger.info("\n%s\n[+] Database tables ready!\n%s", _BAR, _BAR)
     
     port = int(os.getenv("PORT", "5000"))
+    # SERVER=waitress for production. Requests spend their time waiting on
+    # Google and the DB, so run plenty of threads rather than the default 4
+    server = os.getenv("SERVER", "flask").lower()
+    waitress_threads = int(os.getenv("WAITRESS_THREADS", "16"))
+    
+    logger.info(
+        "\n[*] %s Starting...\n[*] Database: tokens.db\n[*] Encryption: Enabled\n"
+        "[*] Scheduler: Active\n[*] Timezone: %s\n[*] OAuth Redirect: %s\n[*] URL: http://127.0.0.1:%s\n\n%s\n",
+        f"Waitress Server ({waitress_threads} threads)" if server == "waitress" else "Flask Development Server",
+        USER_TIMEZONE, REDIRECT_URI, port, _BAR
+    )
     
-    print("\n[*] Flask Development Server Starting...")
-    print("[*] Database: tokens.db")
-    print("[*] Encryption: Enabled")
-    print("[*] Scheduler: Active")
-    print(f"[*] Timezone: {USER_TIMEZONE}")
-    print(f"[*] OAuth Redirect: {REDIRECT_URI}")
-    print(f"[*] URL: http://127.0.0.1:{port}")
-    print("\n" + "=" * 60 + "\n")
-    
-    app.run(port=port, debug=True, use_reloader=False)
\ No newline at end of file
+    if server == "waitress":
+        from waitress import serve
+        serve(app, host=os.getenv("HOST", "127.0.0.1"), port=port, threads=waitress_threads)
+    else:
+        app.run(port=port, debug=True, use_reloader=False)
\ No newline at end of file
@@ -1,11 +1,19 @@
 import os
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from database import get_user_tokens, save_token
+from flask import current_app
+from database import db, get_user_tokens, get_user_tokens_bulk, save_token, token_record_to_dict
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # ============================================
 # GOOGLE OAUTH CONFIGURATION
 # ============================================
@@ -14,6 +22,69 @@ GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
 TOKEN_URL = "https://www.googleapis.com/oauth2/v4/token"
 
+# Keep-alive connections to Google's OAuth endpoints. The adapter owns the
+# connection pool, so main.py mounts it on each login's OAuth2Session too
+OAUTH_HTTP_ADAPTER = HTTPAdapter(pool_connections=4, pool_maxsize=10)
+_SESSION = requests.Session()
+_SESSION.mount('https://', OAUTH_HTTP_ADAPTER)
+
+# Access tokens live ~1 hour, so keep decrypted ones in memory and skip
+# the DB + decrypt until they get close to expiry
+TOKEN_CACHE_LEEWAY = timedelta(seconds=300)
+_token_cache = {}
+_token_cache_lock = threading.Lock()
+# One lock per user so concurrent callers don't all refresh the same token
+_refresh_locks = defaultdict(threading.Lock)
+
+# Expired tokens in a bulk lookup are refreshed this many at a time;
+# stays under OAUTH_HTTP_ADAPTER's pool size
+TOKEN_REFRESH_WORKERS = int(os.getenv("TOKEN_REFRESH_WORKERS", "8"))
+
+
+# ============================================
+# TOKEN CACHE
+# ============================================
+
+def _get_cached_token(user_id):
+    with _token_cache_lock:
+        token_data = _token_cache.get(user_id)
+    
+    if token_data and datetime.utcnow() + TOKEN_CACHE_LEEWAY < token_data['expires_at']:
+        return token_data
+    return None
+
+
+def _cache_token(user_id, token_data):
+    with _token_cache_lock:
+        _token_cache[user_id] = token_data
+
+
+def invalidate_cached_token(user_id):
+    """Drop a cached token, e.g. after the user logs in again"""
+    with _token_cache_lock:
+        _token_cache.pop(user_id, None)
+
+
+def _refresh_once(user_id):
+    """
+    Refresh under the user's lock. Threads that waited on it find the new
+    token in the cache and reuse it instead of calling Google again
+    """
+    with _token_cache_lock:
+        refresh_lock = _refresh_locks[user_id]
+    
+    with refresh_lock:
+        cached_token = _get_cached_token(user_id)
+        if cached_token:
+            return cached_token
+        
+        token_data = refresh_access_token(user_id)
+        if token_data:
+            _cache_token(user_id, token_data)
+        else:
+            invalidate_cached_token(user_id)
+        return token_data
+
 
 # ============================================
 # TOKEN REFRESH FUNCTION
@@ -23,26 +94,18 @@ def refresh_access_token(user_id):
     """
     Refresh expired access token using refresh token
     """
-    print("\n" + "="*60)
-    print("🔄 TOKEN REFRESH STARTED")
-    print("="*60)
-    
     # Step 1: Database se current tokens lo
     token_data = get_user_tokens(user_id)
     
     if not token_data or not token_data['refresh_token']:
-        print("❌ No refresh token found!")
-        print("="*60 + "\n")
+        logger.warning("❌ No refresh token found for user_id: %s", user_id)
         return None
     
     refresh_token = token_data['refresh_token']
-    print(f"✅ Refresh token found for user_id: {user_id}")
     
     # Step 2: Google ko request bhejo
     try:
-        print("📤 Requesting new access token from Google...")
-        
-        response = requests.post(
+        response = _SESSION.post(
             TOKEN_URL,
             data={
                 'client_id': GOOGLE_CLIENT_ID,
@@ -53,9 +116,10 @@ def refresh_access_token(user_id):
         )
         
         if response.status_code != 200:
-            print(f"❌ Token refresh failed: {response.status_code}")
-            print(f"Response: {response.text}")
-            print("="*60 + "\n")
+            logger.error(
+                "❌ Token refresh failed for user_id %s: %s\nResponse: %s",
+                user_id, response.status_code, response.text
+            )
             return None
         
         # Step 3: New token data extract karo
@@ -63,9 +127,6 @@ def refresh_access_token(user_id):
         new_access_token = new_token_data.get('access_token')
         expires_in = new_token_data.get('expires_in', 3600)
         
-        print("✅ New access token received!")
-        print(f"⏰ Expires in: {expires_in} seconds")
-        
         # Step 4: Database mein update karo
         save_token(
             user_id=user_id,
@@ -74,18 +135,17 @@ def refresh_access_token(user_id):
             expires_in=expires_in
         )
         
-        print("💾 New token saved to database!")
-        print("="*60 + "\n")
+        logger.info("🔄 Token refreshed for user_id %s (expires in %ss)", user_id, expires_in)
         
         return {
             'access_token': new_access_token,
             'refresh_token': refresh_token,
-            'expires_in': expires_in
+            'expires_in': expires_in,
+            'expires_at': datetime.utcnow() + timedelta(seconds=expires_in)
         }
         
     except Exception as e:
-        print(f"❌ Exception during token refresh: {str(e)}")
-        print("="*60 + "\n")
+        logger.error("❌ Exception during token refresh for user_id %s: %s", user_id, e)
         return None
 
 
@@ -93,20 +153,87 @@ def get_valid_token(user_id):
     """
     Get valid token (auto-refresh if expired)
     """
-    from database import is_token_expired
+    cached_token = _get_cached_token(user_id)
+    if cached_token:
+        return cached_token
     
-    if is_token_expired(user_id):
-        print(f"⚠️ Token expired for user_id: {user_id}")
-        print("🔄 Auto-refreshing token...")
-        
-        refreshed_token = refresh_access_token(user_id)
+    from database import get_token_record, is_token_expired
+    
+    # One SELECT; expiry and the decrypted tokens both come from this row
+    token_record = get_token_record(user_id)
+    
+    if is_token_expired(user_id, token_record):
+        refreshed_token = _refresh_once(user_id)
         
         if not refreshed_token:
-            print("❌ Token refresh failed!")
+            logger.warning("❌ Token expired and refresh failed for user_id: %s", user_id)
             return None
         
-        print("✅ Token refreshed successfully!")
         return refreshed_token
     
     # Token valid hai
-    return get_user_tokens(user_id)
\ No newline at end of file
+    token_data = get_user_tokens(user_id, token_record)
+    if token_data:
+        _cache_token(user_id, token_data)
+    return token_data
+
+
+def get_valid_tokens_bulk(user_ids, token_records=None):
+    """
+    Get valid tokens for many users with one DB query (auto-refresh expired ones)
+    token_records: already loaded Token rows keyed by user_id, used instead of querying
+    """
+    token_records = token_records or {}
+    tokens = {}
+    loaded_tokens = {}
+    missing_ids = []
+    for user_id in user_ids:
+        cached_token = _get_cached_token(user_id)
+        if cached_token:
+            tokens[user_id] = cached_token
+        elif user_id in token_records:
+            loaded_tokens[user_id] = token_record_to_dict(token_records[user_id])
+        else:
+            missing_ids.append(user_id)
+    
+    loaded_tokens.update(get_user_tokens_bulk(missing_ids))
+    now = datetime.utcnow()
+    
+    expired_ids = []
+    for user_id, token_data in loaded_tokens.items():
+        if now > token_data['expires_at']:
+            expired_ids.append(user_id)
+        else:
+            _cache_token(user_id, token_data)
+            tokens[user_id] = token_data
+    
+    for user_id, token_data in _refresh_many(expired_ids):
+        if not token_data:
+            logger.warning("❌ Token expired and refresh failed for user_id: %s", user_id)
+            continue
+        tokens[user_id] = token_data
+    
+    return tokens
+
+
+def _refresh_many(user_ids):
+    """
+    Refresh several users' tokens in parallel, yields (user_id, token_data).
+    Each worker pushes its own app context so it gets its own DB session
+    """
+    if len(user_ids) < 2:
+        for user_id in user_ids:
+            yield user_id, _refresh_once(user_id)
+        return
+    
+    app = current_app._get_current_object()
+    
+    def refresh(user_id):
+        with app.app_context():
+            try:
+                return user_id, _refresh_once(user_id)
+            finally:
+                db.session.remove()
+    
+    with ThreadPoolExecutor(max_workers=min(TOKEN_REFRESH_WORKERS, len(user_ids))) as executor:
+        yield from executor.map(refresh, user_ids)
\ No newline at end of file